@@ -3,27 +3,52 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from sqlalchemy import inspect, text
 import os
 
 from config import config
+from app.utils.query_cache import QueryResultCache
+from app.utils.ranked_results import RankedResultCache
+from app.utils.sqlite_tuning import configure_engine
+from app.utils.text_index import InvertedIndex
+from app.utils.text_cache import TextCache
+from app.utils.text_store import TextStore
 
 # Initialize extensions
 db = SQLAlchemy()
 login_manager = LoginManager()
 jwt = JWTManager()
+search_index = InvertedIndex()
+text_cache = TextCache()
+text_store = TextStore()
+ranked_results = RankedResultCache()
+query_cache = QueryResultCache()
 
-def create_app(config_name='default'):
-    """Create and configure the Flask application."""
+def create_app(config_name='default', config_overrides=None):
+    """Create and configure the Flask application.
+    
+    ``config_overrides`` take precedence over the configuration class, e.g.
+    to keep the files of a test application in a temporary folder.
+    """
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(config[config_name])
+    if config_overrides:
+        app.config.update(config_overrides)
     
     # Ensure instance folder exists
     os.makedirs(app.instance_path, exist_ok=True)
     
     # Initialize extensions with app
     db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
     login_manager.init_app(app)
     jwt.init_app(app)
+    search_index.init_app(app)
+    text_cache.init_app(app)
+    text_store.init_app(app)
+    ranked_results.init_app(app)
+    query_cache.init_app(app)
     
     # Register JWT error handlers
     @jwt.expired_token_loader
@@ -51,8 +76,61 @@ def create_app(config_name='default'):
     app.register_blueprint(search_bp, url_prefix='/api/search')
     
     # Create database tables
+    from app.models.scan_job import ScanJob
+    from app.models.extraction_failure import ExtractionFailure
+    from app.models.search import Search
+    from app.utils.fts_index import FtsIndex
+    from app.utils.history_writer import history_writer
+    from app.utils.scan_jobs import scan_jobs
+    
+    scan_jobs.init_app(app)
+    history_writer.init_app(app)
+    
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+        FtsIndex.create_table()
+        scan_jobs.recover_interrupted()
         print("Database tables created at:", app.instance_path)
     
-    return app
\ No newline at end of file
+    if app.config['WATCH_LIBRARY']:
+        from app.utils.library_watcher import library_watcher
+        
+        library_watcher.init_app(app)
+        library_watcher.start()
+    
+    return app
+
+
+def upgrade_schema():
+    """Add columns and indexes that were introduced after a table was created.
+    
+    Columns whose values can be derived from existing rows are filled in
+    once, when they are added.
+    """
+    inspector = inspect(db.engine)
+    added = set()
+    
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            added.add((table.name, column.name))
+            print(f"Added column {table.name}.{column.name}")
+        
+        db.session.commit()
+        
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    
+    if ('searches', 'result_count') in added:
+        from app.models.search import Search
+        
+        Search.backfill_result_counts()
\ No newline at end of file
@@ -11,24 +11,37 @@ class Book(db.Model):
     file_path = db.Column(db.String(512), nullable=False, unique=True)
     file_format = db.Column(db.String(10), nullable=False, index=True)
     file_size = db.Column(db.Integer, nullable=True)  # Size in bytes
+    file_mtime = db.Column(db.Float, nullable=True)  # Modification time when last scanned
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the file, keys the text store
     indexed_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_accessed = db.Column(db.DateTime, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)  # Set when the file disappears from the library
     
     # Relationships
     search_results = db.relationship('SearchResult', backref='book', lazy='dynamic', cascade='all, delete-orphan')
     
-    def to_dict(self):
-        """Convert book to dictionary."""
-        return {
-            'id': self.id,
-            'title': self.title,
-            'author': self.author,
-            'file_path': self.file_path,
-            'file_format': self.file_format,
-            'file_size': self.file_size,
-            'indexed_at': self.indexed_at.isoformat() if self.indexed_at else None,
-            'last_accessed': self.last_accessed.isoformat() if self.last_accessed else None
-        }
+    @classmethod
+    def active(cls):
+        """Query books whose files are still present in the library."""
+        return cls.query.filter(cls.deleted_at.is_(None))
+    
+    # Attributes that to_dict can return, each stored in the column of the same name
+    FIELDS = ('id', 'title', 'author', 'file_path', 'file_format', 'file_size', 'indexed_at', 'last_accessed')
+    
+    def to_dict(self, fields=None):
+        """Convert book to dictionary, optionally with only some of its FIELDS."""
+        book = {}
+        for field in fields or self.FIELDS:
+            value = getattr(self, field)
+            book[field] = value.isoformat() if isinstance(value, datetime) else value
+        return book
     
     def __repr__(self):
-        return f'<Book {self.title}>'
\ No newline at end of file
+        return f'<Book {self.title}>'
+
+
+# Indexes for the title and author prefix filters of the book listing, which only lists books
+# that are not deleted. LIKE ignores the case of ASCII letters, so SQLite can only use an index
+# with the NOCASE collation for it.
+db.Index('ix_books_active_title_nocase', Book.deleted_at, db.collate(Book.title, 'NOCASE'))
+db.Index('ix_books_active_author_nocase', Book.deleted_at, db.collate(Book.author, 'NOCASE'))
\ No newline at end of file
@@ -0,0 +1,97 @@
+import os
+import logging
+from datetime import datetime
+from app import db
+
+logger = logging.getLogger(__name__)
+
+class ExtractionFailure(db.Model):
+    """ExtractionFailure model for quarantining ebook files that keep failing to extract."""
+    __tablename__ = 'extraction_failures'
+
+    id = db.Column(db.Integer, primary_key=True)
+    file_path = db.Column(db.String(512), nullable=False, unique=True)
+    file_size = db.Column(db.Integer, nullable=True)  # Size of the file that failed
+    file_mtime = db.Column(db.Float, nullable=True)  # Modification time of the file that failed
+    failures = db.Column(db.Integer, nullable=False, default=0)  # Consecutive failures of this version of the file
+    last_error = db.Column(db.Text, nullable=True)
+    last_failed_at = db.Column(db.DateTime, nullable=True)
+    quarantined_at = db.Column(db.DateTime, nullable=True, index=True)  # Set once the file is no longer retried
+
+    @classmethod
+    def record(cls, file_path, error, max_failures):
+        """Record a failed extraction, quarantining the file after max_failures in a row.
+
+        A file that changed since its last failure starts counting again.
+        The caller commits the session.
+        """
+        try:
+            stat = os.stat(file_path)
+            file_size, file_mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            file_size = file_mtime = None
+
+        entry = cls.query.filter_by(file_path=file_path).first()
+        if entry is None:
+            entry = cls(file_path=file_path, failures=0)
+            db.session.add(entry)
+        elif entry.file_size != file_size or entry.file_mtime != file_mtime:
+            entry.failures = 0
+            entry.quarantined_at = None
+
+        entry.file_size = file_size
+        entry.file_mtime = file_mtime
+        entry.failures += 1
+        entry.last_error = str(error)
+        entry.last_failed_at = datetime.utcnow()
+
+        if entry.failures >= max_failures and entry.quarantined_at is None:
+            entry.quarantined_at = entry.last_failed_at
+            logger.warning(f"Quarantined {file_path} after {entry.failures} failed extractions: {error}")
+
+        return entry
+
+    @classmethod
+    def clear(cls, file_path):
+        """Forget past failures of a file that was processed successfully."""
+        cls.query.filter_by(file_path=file_path).delete()
+
+    @classmethod
+    def by_path(cls):
+        """Load the recorded failures as lightweight rows keyed by file path."""
+        rows = db.session.query(cls.file_path, cls.file_size, cls.file_mtime, cls.quarantined_at).all()
+        return {row.file_path: row for row in rows}
+
+    @staticmethod
+    def quarantines(failures, file_path, file_size=None, file_mtime=None):
+        """Check whether failures loaded with ``by_path`` quarantine this version of a file.
+
+        A quarantine only holds until the file's size or modification time
+        changes; they are read from the file unless given.
+        """
+        failure = failures.get(file_path)
+        if failure is None or failure.quarantined_at is None:
+            return False
+
+        if file_size is None and file_mtime is None:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return True
+            file_size, file_mtime = stat.st_size, stat.st_mtime
+
+        return failure.file_size == file_size and failure.file_mtime == file_mtime
+
+    def to_dict(self):
+        """Convert extraction failure to dictionary."""
+        return {
+            'id': self.id,
+            'file_path': self.file_path,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'last_failed_at': self.last_failed_at.isoformat() if self.last_failed_at else None,
+            'quarantined_at': self.quarantined_at.isoformat() if self.quarantined_at else None
+        }
+
+    def __repr__(self):
+        return f'<ExtractionFailure {self.file_path}>'
@@ -0,0 +1,69 @@
+import json
+from datetime import datetime
+from app import db
+
+class ScanJob(db.Model):
+    """ScanJob model for tracking background library scans."""
+    __tablename__ = 'scan_jobs'
+
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    mode = db.Column(db.String(20), nullable=False, default='incremental')
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, completed, failed, interrupted
+    phase = db.Column(db.String(20), nullable=True)  # scanning or indexing while running
+    phase_started_at = db.Column(db.DateTime, nullable=True)
+    worker_pid = db.Column(db.Integer, nullable=True)  # Process running the job
+    files_discovered = db.Column(db.Integer, nullable=False, default=0)
+    files_processed = db.Column(db.Integer, nullable=False, default=0)
+    files_failed = db.Column(db.Integer, nullable=False, default=0)
+    books_to_index = db.Column(db.Integer, nullable=False, default=0)
+    books_indexed = db.Column(db.Integer, nullable=False, default=0)
+    summary = db.Column(db.Text, nullable=True)  # JSON summary of changes once finished
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        """Convert scan job to dictionary, including throughput and ETA."""
+        now = datetime.utcnow()
+        end = self.finished_at or now
+        elapsed = (end - self.started_at).total_seconds() if self.started_at else 0.0
+        throughput = self.files_processed / elapsed if elapsed > 0 else 0.0
+
+        # Estimate the time left in the current phase from its own rate
+        eta = None
+        if self.status == 'running' and self.phase_started_at:
+            phase_elapsed = (now - self.phase_started_at).total_seconds()
+            if self.phase == 'indexing':
+                done, total = self.books_indexed, self.books_to_index
+            else:
+                done, total = self.files_processed, self.files_discovered
+            if done and phase_elapsed > 0:
+                eta = max(0, total - done) * phase_elapsed / done
+
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'mode': self.mode,
+            'status': self.status,
+            'phase': self.phase,
+            'files_discovered': self.files_discovered,
+            'files_processed': self.files_processed,
+            'files_failed': self.files_failed,
+            'books_to_index': self.books_to_index,
+            'books_indexed': self.books_indexed,
+            'elapsed_seconds': elapsed,
+            'throughput': throughput,  # Files per second
+            'eta_seconds': eta,
+            'summary': json.loads(self.summary) if self.summary else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<ScanJob {self.id} {self.status}>'
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from app import db
 
@@ -9,10 +10,29 @@ class Search(db.Model):
     query = db.Column(db.String(255), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    partial = db.Column(db.Boolean, default=False)  # Books were left unsearched when the search was cut short
+    result_count = db.Column(db.Integer, default=0)  # Number of results found, kept here to list history without counting them
+    stored_count = db.Column(db.Integer, nullable=True)  # Number of results saved, fewer than found with SEARCH_HISTORY_TOP_K
     
     # Relationships
     results = db.relationship('SearchResult', backref='search', lazy='dynamic', cascade='all, delete-orphan')
     
+    @classmethod
+    def backfill_result_counts(cls):
+        """Count the saved results of searches recorded before result counts were stored.
+        
+        Run by ``upgrade_schema`` when the result_count column is added.
+        """
+        counts = db.select(db.func.count(SearchResult.id)).where(
+            SearchResult.search_id == cls.id
+        ).scalar_subquery()
+        db.session.execute(db.update(cls).where(cls.result_count.is_(None)).values(result_count=counts))
+        db.session.commit()
+    
+    def saved_count(self):
+        """Return the number of results saved to the history; searches saved before it was stored kept all."""
+        return self.stored_count if self.stored_count is not None else (self.result_count or 0)
+    
     def to_dict(self):
         """Convert search to dictionary."""
         return {
@@ -20,7 +40,9 @@ class Search(db.Model):
             'query': self.query,
             'user_id': self.user_id,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'result_count': self.results.count()
+            'result_count': self.result_count or 0,
+            'stored_count': self.saved_count(),
+            'partial': bool(self.partial)
         }
     
     def __repr__(self):
@@ -30,12 +52,24 @@ class Search(db.Model):
 class SearchResult(db.Model):
     """SearchResult model for storing search results."""
     __tablename__ = 'search_results'
+    # Results are loaded by search, and their snippets updated by search and book
+    __table_args__ = (db.Index('ix_search_results_search_id_book_id', 'search_id', 'book_id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     search_id = db.Column(db.Integer, db.ForeignKey('searches.id'), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     relevance_score = db.Column(db.Float, nullable=True)
     match_context = db.Column(db.Text, nullable=True)  # Snippet of text where match was found
+    page = db.Column(db.Integer, nullable=True)  # 1-based page (PDF) or chapter (EPUB) of the match
+    snippets = db.Column(db.Text, nullable=True)  # JSON list of the best snippets with their locations
+    
+    def get_snippets(self):
+        """Return the stored snippets, falling back to the single match context of older results."""
+        if self.snippets:
+            return json.loads(self.snippets)
+        if self.match_context:
+            return [{'text': self.match_context, 'page': self.page, 'label': None}]
+        return []
     
     def to_dict(self):
         """Convert search result to dictionary."""
@@ -44,7 +78,9 @@ class SearchResult(db.Model):
             'search_id': self.search_id,
             'book_id': self.book_id,
             'relevance_score': self.relevance_score,
-            'match_context': self.match_context
+            'match_context': self.match_context,
+            'page': self.page,
+            'snippets': self.get_snippets()
         }
     
     def __repr__(self):
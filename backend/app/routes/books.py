@@ -1,18 +1,33 @@
 import os
+import json
+import base64
 from datetime import datetime
-from flask import Blueprint, jsonify, request, send_file, current_app
+from flask import Blueprint, Response, jsonify, request, send_file, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only
 
 from app import db
 from app.models.book import Book
-from app.utils.library_scanner import LibraryScanner
+from app.models.scan_job import ScanJob
+from app.utils.scan_jobs import scan_jobs
 
 books_bp = Blueprint('books', __name__)
 
+# Columns the book listing can be sorted on, all of them indexed
+SORT_COLUMNS = ('id', 'title', 'author', 'file_format')
+# Books loaded from the database at a time while a listing is streamed
+LIST_BATCH_SIZE = 500
+
 @books_bp.route('/scan', methods=['POST'])
 @jwt_required()
 def scan_library():
-    """Scan the library directory and index all ebooks."""
+    """Start a background scan of the library directory.
+    
+    Scans are incremental unless the request body contains {"mode": "full"}.
+    Returns the id of the scan job, whose progress is reported by
+    GET /api/books/scan/<job_id>.
+    """
     try:
         # Get user identity from JWT (it will be a string)
         user_id = get_jwt_identity()
@@ -20,46 +35,171 @@ def scan_library():
         
         if not user_id:
             return jsonify({'error': 'Invalid authentication token'}), 401
-            
-        library_path = current_app.config['LIBRARY_PATH']
-        supported_formats = current_app.config['SUPPORTED_FORMATS']
         
-        # Make sure the library directory exists
-        if not os.path.exists(library_path):
-            os.makedirs(library_path, exist_ok=True)
-            print(f"Created library directory: {library_path}")
+        data = request.get_json(silent=True) or {}
+        mode = 'full' if data.get('mode') == 'full' else 'incremental'
         
-        scanner = LibraryScanner(library_path, supported_formats)
-        books = scanner.scan_library()
+        job, created = scan_jobs.submit(int(user_id), mode)
         
         return jsonify({
-            'message': f'Indexed {len(books)} books',
-            'count': len(books)
-        }), 200
+            'message': 'Library scan started' if created else 'A library scan is already in progress',
+            'job_id': job.id,
+            'job': job.to_dict()
+        }), 202
     except Exception as e:
         print(f"Error scanning library: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@books_bp.route('/scan/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_scan_job(job_id):
+    """Get the status and progress of a library scan job."""
+    try:
+        job = db.session.get(ScanJob, job_id)
+        
+        if not job:
+            return jsonify({'error': 'Scan job not found'}), 404
+        
+        return jsonify({'job': job.to_dict()}), 200
+    except Exception as e:
+        print(f"Error getting scan job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+def encode_cursor(sort, order, value, book_id):
+    """Build the opaque cursor pointing after a book in a sorted listing."""
+    return base64.urlsafe_b64encode(json.dumps([sort, order, value, book_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, order):
+    """Return the (sort value, book id) a cursor points after, raising ValueError if it is invalid."""
+    try:
+        cursor_sort, cursor_order, value, book_id = json.loads(
+            base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        )
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if (cursor_sort, cursor_order) != (sort, order) or not isinstance(book_id, int):
+        raise ValueError('Invalid cursor')
+    return value, book_id
+
+
+def after(column, value, book_id, descending):
+    """Filter for the books that come after (value, book_id) when sorting on column, then id.
+    
+    SQLite sorts NULLs before any other value, so they come first in
+    ascending and last in descending order.
+    """
+    if descending:
+        if value is None:
+            return and_(column.is_(None), Book.id < book_id)
+        return or_(column < value, and_(column == value, Book.id < book_id), column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), Book.id > book_id), column.isnot(None))
+    return or_(column > value, and_(column == value, Book.id > book_id))
+
+
+def starts_with(column, prefix):
+    """Filter for values of column starting with prefix, ignoring the case of ASCII letters.
+    
+    SQLite turns the LIKE into a range on the column's NOCASE index.
+    """
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.like(escaped + '%', escape='\\')
+
+
 @books_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_books():
-    """Get all books or filter by format."""
+    """List books, optionally filtered, sorted and one page at a time.
+    
+    Query parameters:
+    
+    - ``format``: only books in this file format
+    - ``title_prefix``, ``author_prefix``: only books whose title or author
+      starts with the prefix, ignoring case
+    - ``sort``: one of id (default), title, author or file_format, with
+      ``order`` asc (default) or desc
+    - ``fields``: comma-separated book fields to return, all by default
+    - ``limit``: books per page, BOOKS_PAGE_SIZE by default and at most
+      BOOKS_MAX_PAGE_SIZE
+    
+    The response holds a ``next_cursor`` to pass as ``cursor`` for the next
+    page, or null on the last page. Pages are streamed from the database in
+    batches, so even the largest pages are not loaded into memory at once.
+    """
     try:
-        format_filter = request.args.get('format')
+        sort = request.args.get('sort', 'id')
+        order = request.args.get('order', 'asc')
+        if sort not in SORT_COLUMNS or order not in ('asc', 'desc'):
+            return jsonify({'error': f"Books can be sorted on {', '.join(SORT_COLUMNS)}, in asc or desc order"}), 400
+        
+        fields = request.args.get('fields')
+        if fields:
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+            unknown = [field for field in fields if field not in Book.FIELDS]
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        else:
+            fields = None
         
+        limit = request.args.get('limit', current_app.config['BOOKS_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, current_app.config['BOOKS_MAX_PAGE_SIZE']))
+        
+        column = getattr(Book, sort)
+        descending = order == 'desc'
+        query = Book.active()
+        
+        format_filter = request.args.get('format')
         if format_filter:
-            books = Book.query.filter_by(file_format=format_filter).all()
+            query = query.filter(Book.file_format == format_filter)
+        if request.args.get('title_prefix'):
+            query = query.filter(starts_with(Book.title, request.args['title_prefix']))
+        if request.args.get('author_prefix'):
+            query = query.filter(starts_with(Book.author, request.args['author_prefix']))
+        
+        if request.args.get('cursor'):
+            try:
+                value, book_id = decode_cursor(request.args['cursor'], sort, order)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            query = query.filter(after(column, value, book_id, descending))
+        
+        if descending:
+            query = query.order_by(column.desc(), Book.id.desc())
         else:
-            books = Book.query.all()
+            query = query.order_by(column, Book.id)
         
-        return jsonify({
-            'books': [book.to_dict() for book in books],
-            'count': len(books)
-        }), 200
+        # Only load the columns that are returned or needed for the cursor
+        loaded = set(fields or Book.FIELDS) | {'id', sort}
+        query = query.options(load_only(*[getattr(Book, field) for field in loaded]))
+        # One more book tells whether there is a next page
+        query = query.limit(limit + 1)
     except Exception as e:
         print(f"Error getting books: {str(e)}")
         return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        yield '{"books": ['
+        count = 0
+        next_cursor = None
+        try:
+            for book in query.yield_per(LIST_BATCH_SIZE):
+                if count == limit:
+                    next_cursor = encode_cursor(sort, order, getattr(last, sort), last.id)
+                    break
+                yield (', ' if count else '') + json.dumps(book.to_dict(fields))
+                count += 1
+                last = book
+        except Exception as e:
+            # The status line is already sent, so report the error in the body
+            print(f"Error getting books: {str(e)}")
+            yield f'], "error": {json.dumps(str(e))}}}'
+            return
+        yield f'], "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 
 @books_bp.route('/<int:book_id>', methods=['GET'])
@@ -99,7 +239,9 @@ def get_book_file(book_id):
         mime_types = {
             'pdf': 'application/pdf',
             'epub': 'application/epub+zip',
-            'azw3': 'application/x-mobi8-ebook'
+            'azw3': 'application/x-mobi8-ebook',
+            'azw': 'application/vnd.amazon.ebook',
+            'mobi': 'application/x-mobipocket-ebook'
         }
         
         mime_type = mime_types.get(book.file_format, 'application/octet-stream')
@@ -120,7 +262,7 @@ def get_book_file(book_id):
 def get_formats():
     """Get all available book formats."""
     try:
-        formats = db.session.query(Book.file_format).distinct().all()
+        formats = db.session.query(Book.file_format).filter(Book.deleted_at.is_(None)).distinct().all()
         formats = [format[0] for format in formats]
         
         return jsonify({
@@ -1,16 +1,101 @@
-from flask import Blueprint, jsonify, request
+import json
+import base64
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-from app import db
-from app.models.search import Search
+from app import db, query_cache, ranked_results, text_cache
+from app.models.search import Search, SearchResult
+from app.utils.history_writer import history_writer
+from app.utils.query_parser import QueryError
 from app.utils.search_engine import SearchEngine
 
 search_bp = Blueprint('search', __name__)
 
+
+def serialize_result(book, relevance, snippets):
+    """Convert a search result to a dictionary; context and page describe the best snippet."""
+    return {
+        'book': book.to_dict(),
+        'relevance': relevance,
+        'context': snippets[0]['text'] if snippets else "",
+        'page': snippets[0]['page'] if snippets else None,
+        'snippets': snippets
+    }
+
+
+def encode_cursor(search_id, offset):
+    """Build the opaque cursor pointing at a position in a search's results."""
+    return base64.urlsafe_b64encode(f"{search_id}:{offset}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, search_id):
+    """Return the offset a cursor points at, raising ValueError if it is invalid for the search."""
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        cursor_search_id, offset = (int(part) for part in decoded.split(':'))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if cursor_search_id != search_id or offset < 0:
+        raise ValueError('Invalid cursor')
+    return offset
+
+
+def page_args(values, search_id=None):
+    """Read the page offset and size from request values, which may hold a cursor instead of an offset."""
+    try:
+        limit = int(values.get('limit') or current_app.config['SEARCH_PAGE_SIZE'])
+        offset = int(values.get('offset') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid offset or limit')
+    limit = max(1, min(limit, current_app.config['SEARCH_MAX_PAGE_SIZE']))
+    if values.get('cursor'):
+        return decode_cursor(values['cursor'], search_id), limit
+    return max(0, offset), limit
+
+
+def search_timeout(data):
+    """Read the search deadline in milliseconds from a request body, defaulting to the configured one."""
+    try:
+        timeout_ms = int(data.get('timeout_ms') or current_app.config['SEARCH_TIMEOUT_MS'])
+    except (TypeError, ValueError):
+        raise ValueError('Invalid timeout_ms')
+    return max(0, timeout_ms) or None
+
+
+def results_page(search, available, offset, limit, results):
+    """Build the response for one page of a search's results.
+    
+    ``available`` is the number of results that can be paged through: all
+    of them while the ranking is cached, else only those saved to the
+    history. ``total`` is always the number of results found.
+    """
+    next_offset = offset + limit
+    return {
+        'search_id': search.id,
+        'query': search.query,
+        'timestamp': search.timestamp.isoformat(),
+        'results': [
+            serialize_result(book, relevance, snippets)
+            for book, relevance, snippets in results
+        ],
+        'count': len(results),
+        'total': search.result_count if search.result_count is not None else available,
+        'stored_count': search.saved_count(),
+        'partial': bool(search.partial),
+        'offset': offset,
+        'limit': limit,
+        'next_cursor': encode_cursor(search.id, next_offset) if next_offset < available else None
+    }
+
+
 @search_bp.route('/', methods=['POST'])
 @jwt_required()
 def search():
-    """Search for books matching a query."""
+    """Search for books matching a query.
+    
+    A ``timeout_ms`` deadline may be given in the body; searches that take
+    longer return the results found so far with ``partial`` set.
+    """
     try:
         data = request.get_json()
         
@@ -26,27 +111,92 @@ def search():
             
         query = data['query']
         max_results = data.get('max_results', 50)
+        try:
+            offset, limit = page_args({'offset': data.get('offset'), 'limit': data.get('limit')})
+            timeout_ms = search_timeout(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         search_engine = SearchEngine()
-        search, results = search_engine.search(query, int(user_id), max_results)
+        search, _ = search_engine.search(query, int(user_id), max_results, timeout_ms)
+        available, results = search_engine.get_results_page(search, offset, limit)
         
-        return jsonify({
-            'search_id': search.id,
-            'query': search.query,
-            'timestamp': search.timestamp.isoformat(),
-            'results': [
-                {
-                    'book': book.to_dict(),
-                    'relevance': relevance,
-                    'context': context
-                }
-                for book, relevance, context in results
-            ],
-            'count': len(results)
-        }), 200
+        return jsonify(results_page(search, available, offset, limit, results)), 200
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error during search: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@search_bp.route('/stream', methods=['POST'])
+@jwt_required()
+def search_stream():
+    """Search for books matching a query, streaming the results as they are found.
+    
+    Takes the same body as POST /api/search/ and responds with
+    newline-delimited JSON events:
+    
+    - {"type": "start", "query"} once the search has started
+    - {"type": "progress", "searched", "total"} as books are searched
+    - {"type": "hit", ...} for each matching book as it is found, in the
+      same format as a search result
+    - {"type": "results", ...} last, with the first page of the final
+      ranking in the format returned by POST /api/search/
+    - {"type": "error", "error"} if the search fails after it has started
+    
+    Books that are not searched yet are abandoned when the ``timeout_ms``
+    deadline passes, in which case the results are flagged ``partial``,
+    or when the client disconnects.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('query'):
+            return jsonify({'error': 'Missing query parameter'}), 400
+        
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({'error': 'Invalid authentication token'}), 401
+        
+        max_results = data.get('max_results', 50)
+        try:
+            offset, limit = page_args({'offset': data.get('offset'), 'limit': data.get('limit')})
+            timeout_ms = search_timeout(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        search_engine = SearchEngine()
+        events = search_engine.search_stream(data['query'], int(user_id), max_results, timeout_ms)
+        # Start the search here so that invalid queries are rejected before streaming
+        next(events)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error during search: {str(e)}")
         return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        yield json.dumps({'type': 'start', 'query': data['query']}) + '\n'
+        try:
+            for event in events:
+                if event[0] == 'progress':
+                    line = {'type': 'progress', 'searched': event[1], 'total': event[2]}
+                elif event[0] == 'hit':
+                    line = dict(serialize_result(*event[1:]), type='hit')
+                else:
+                    search = event[1]
+                    available, results = search_engine.get_results_page(search, offset, limit)
+                    line = dict(results_page(search, available, offset, limit, results), type='results')
+                yield json.dumps(line) + '\n'
+        except Exception as e:
+            print(f"Error during search: {str(e)}")
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+        finally:
+            # Stop searching when the client has gone away before the search finished
+            events.close()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 @search_bp.route('/history', methods=['GET'])
@@ -78,7 +228,11 @@ def get_search_history():
 @search_bp.route('/history/<int:search_id>', methods=['GET'])
 @jwt_required()
 def get_search_results(search_id):
-    """Get results for a specific search."""
+    """Get one page of results for a specific search.
+    
+    The page is selected with ``offset`` and ``limit``, or with the
+    ``cursor`` returned as ``next_cursor`` by the previous page.
+    """
     try:
         # Get user identity from JWT (it will be a string)
         user_id = get_jwt_identity()
@@ -86,27 +240,19 @@ def get_search_results(search_id):
             return jsonify({'error': 'Invalid authentication token'}), 401
         
         # Check if search belongs to user
-        search = Search.query.get(search_id)
+        search = db.session.get(Search, search_id)
         if not search or search.user_id != int(user_id):
             return jsonify({'error': 'Search not found'}), 404
         
+        try:
+            offset, limit = page_args(request.args, search_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         search_engine = SearchEngine()
-        search, results = search_engine.get_search_results(search_id)
+        available, results = search_engine.get_results_page(search, offset, limit)
         
-        return jsonify({
-            'search_id': search.id,
-            'query': search.query,
-            'timestamp': search.timestamp.isoformat(),
-            'results': [
-                {
-                    'book': book.to_dict(),
-                    'relevance': relevance,
-                    'context': context
-                }
-                for book, relevance, context in results
-            ],
-            'count': len(results)
-        }), 200
+        return jsonify(results_page(search, available, offset, limit, results)), 200
     except Exception as e:
         print(f"Error getting search results: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -123,16 +269,34 @@ def delete_search(search_id):
             return jsonify({'error': 'Invalid authentication token'}), 401
         
         # Check if search belongs to user
-        search = Search.query.get(search_id)
+        search = db.session.get(Search, search_id)
         if not search or search.user_id != int(user_id):
             return jsonify({'error': 'Search not found'}), 404
         
-        # Delete search and its results
+        # Delete search and its results, once the results being saved are written
+        history_writer.flush()
+        SearchResult.query.filter_by(search_id=search_id).delete(synchronize_session=False)
         db.session.delete(search)
         db.session.commit()
+        ranked_results.invalidate(search_id)
         
         return jsonify({'message': 'Search deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
         print(f"Error deleting search: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@search_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def get_search_stats():
+    """Get cache statistics for the search engine."""
+    try:
+        return jsonify({
+            'text_cache': text_cache.stats(),
+            'ranked_results': ranked_results.stats(),
+            'query_cache': query_cache.stats()
+        }), 200
+    except Exception as e:
+        print(f"Error getting search stats: {str(e)}")
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
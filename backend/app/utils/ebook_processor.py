@@ -1,53 +1,22 @@
+import io
 import os
-import re
+import hashlib
 import logging
 import time
 from pathlib import Path
-import PyPDF2
-import ebooklib
-from ebooklib import epub
-from pdfminer.high_level import extract_text as pdfminer_extract_text
-import threading
-import signal
-from functools import wraps
+from app.utils.epub_reader import EpubReader
+from app.utils.mobi_reader import MobiReader
 
 # Set pdfminer logging to WARNING level to reduce verbosity
 logging.getLogger('pdfminer').setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
-# Define a timeout exception
-class TimeoutError(Exception):
-    pass
-
-# Timeout decorator for functions that may take too long
-def timeout(seconds=30):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            result = [TimeoutError('Function timed out after {} seconds'.format(seconds))]
-            
-            def target():
-                try:
-                    result[0] = func(*args, **kwargs)
-                except Exception as e:
-                    result[0] = e
-            
-            thread = threading.Thread(target=target)
-            thread.daemon = True
-            thread.start()
-            thread.join(seconds)
-            
-            if isinstance(result[0], Exception):
-                raise result[0]
-            return result[0]
-        return wrapper
-    return decorator
-
 class EbookProcessor:
     """Utility class for processing ebooks."""
     
-    MAX_PDF_PAGES = 50  # Limit for initial indexing to prevent extremely large PDFs from hanging
+    SECTION_BREAK = '\f'  # Separates pages (PDF) and documents (EPUB) in extracted text
+    MOBI_FORMATS = ('mobi', 'azw', 'azw3')  # Read with the built-in MOBI/KF8 reader
     
     @staticmethod
     def get_metadata_from_file(file_path):
@@ -70,34 +39,72 @@ class EbookProcessor:
             elif file_ext == 'epub':
                 epub_metadata = EbookProcessor._extract_epub_metadata(file_path)
                 metadata.update(epub_metadata)
-            # Add support for azw3 if needed
+            elif file_ext in EbookProcessor.MOBI_FORMATS:
+                mobi_metadata = EbookProcessor._extract_mobi_metadata(file_path)
+                metadata.update(mobi_metadata)
         except Exception as e:
             logger.error(f"Error extracting metadata from {file_path}: {str(e)}")
         
         return metadata
     
     @staticmethod
-    @timeout(60)  # Set a 60-second timeout for text extraction
-    def extract_text_from_file(file_path):
-        """Extract text content from an ebook file."""
+    def iter_sections(file_path):
+        """Yield the text of an ebook one section (PDF page, EPUB document or MOBI chapter) at a time.
+        
+        Only the current section is held in memory, so books of any size can be
+        streamed into the text store and the search indexes.
+        """
+        for _, text in EbookProcessor.iter_labeled_sections(file_path):
+            yield text
+    
+    @staticmethod
+    def iter_labeled_sections(file_path):
+        """Yield (label, text) for each section of an ebook.
+        
+        The label is the chapter id for EPUB documents and None for formats
+        whose sections are only numbered.
+        """
         file_ext = Path(file_path).suffix.lower().lstrip('.')
         
+        if file_ext == 'pdf':
+            for text in EbookProcessor._iter_pdf_pages(file_path):
+                yield None, text
+        elif file_ext == 'epub':
+            yield from EbookProcessor._iter_epub_chapters(file_path)
+        elif file_ext in EbookProcessor.MOBI_FORMATS:
+            for text in EbookProcessor._iter_mobi_sections(file_path):
+                yield None, text
+    
+    @staticmethod
+    def extract_text_from_file(file_path):
+        """Extract the whole text content from an ebook file.
+        
+        This runs in the calling process without any limits; use an
+        ExtractionPool to extract untrusted files.
+        """
         try:
-            if file_ext == 'pdf':
-                return EbookProcessor._extract_text_from_pdf(file_path)
-            elif file_ext == 'epub':
-                return EbookProcessor._extract_text_from_epub(file_path)
-            # Add support for azw3 if needed
-        except TimeoutError:
-            logger.error(f"Timeout extracting text from {file_path}")
-            return f"[Timeout extracting text from {os.path.basename(file_path)}]"
+            return EbookProcessor.SECTION_BREAK.join(EbookProcessor.iter_sections(file_path))
+        except MemoryError:
+            raise
         except Exception as e:
             logger.error(f"Error extracting text from {file_path}: {str(e)}")
             return ""
     
+    @staticmethod
+    def compute_file_hash(file_path, chunk_size=1024 * 1024):
+        """Compute the SHA-256 hash of a file's content."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
     @staticmethod
     def _extract_pdf_metadata(file_path):
         """Extract metadata from a PDF file."""
+        # The PDF libraries are slow to import, so they are only loaded once a PDF is read
+        import PyPDF2
+        
         metadata = {}
         
         try:
@@ -121,81 +128,140 @@ class EbookProcessor:
         metadata = {}
         
         try:
-            book = epub.read_epub(file_path)
-            
-            # Get title
-            title = book.get_metadata('DC', 'title')
-            if title:
-                metadata['title'] = title[0][0]
-            
-            # Get author
-            creator = book.get_metadata('DC', 'creator')
-            if creator:
-                metadata['author'] = creator[0][0]
+            with EpubReader(file_path) as book:
+                for key, value in book.metadata().items():
+                    if value:
+                        metadata[key] = value
         except Exception as e:
             logger.error(f"Error extracting EPUB metadata from {file_path}: {str(e)}")
         
         return metadata
     
     @staticmethod
-    def _extract_text_from_pdf(file_path):
-        """Extract text content from a PDF file."""
+    def _extract_mobi_metadata(file_path):
+        """Extract metadata from a MOBI, AZW or AZW3 file."""
+        metadata = {}
+        
         try:
-            # First, get page count to check if it's too large
+            with MobiReader(file_path) as book:
+                for key, value in book.metadata().items():
+                    if value:
+                        metadata[key] = value
+        except Exception as e:
+            logger.error(f"Error extracting MOBI metadata from {file_path}: {str(e)}")
+        
+        return metadata
+    
+    @staticmethod
+    def _iter_pdf_pages(file_path):
+        """Yield the text of each page of a PDF, one page at a time.
+        
+        Pages are laid out with pdfminer for better quality extraction. A page
+        pdfminer cannot handle falls back to PyPDF2, and if pdfminer cannot
+        read the document at all the remaining pages come from PyPDF2.
+        
+        Raises ValueError if neither library could read a single page, and
+        lets MemoryError through, so that the file counts as a failed
+        extraction rather than as a book without text.
+        """
+        import PyPDF2
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+        from pdfminer.pdfpage import PDFPage
+        
+        fallback_reader = None
+        # Pages whose text was read, and pages (or the document) that could not be read
+        extracted = failed = 0
+        
+        def fallback_page(page_number):
+            nonlocal fallback_reader, extracted, failed
+            try:
+                if fallback_reader is None:
+                    fallback_reader = PyPDF2.PdfReader(file_path)
+                text = fallback_reader.pages[page_number].extract_text() or ""
+            except MemoryError:
+                raise
+            except Exception as e:
+                logger.error(f"Error extracting text from page {page_number} of {file_path}: {str(e)}")
+                failed += 1
+                return ""
+            extracted += 1
+            return text
+        
+        page_number = 0
+        complete = False
+        try:
+            resource_manager = PDFResourceManager()
             with open(file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                num_pages = len(reader.pages)
-                
-                # If the PDF has too many pages, only extract from a subset
-                if num_pages > EbookProcessor.MAX_PDF_PAGES:
-                    logger.warning(f"PDF {file_path} has {num_pages} pages, extracting only first {EbookProcessor.MAX_PDF_PAGES} pages")
-                    text = ""
-                    for page_num in range(min(EbookProcessor.MAX_PDF_PAGES, num_pages)):
-                        try:
-                            text += reader.pages[page_num].extract_text() + "\n"
-                        except Exception as e:
-                            logger.error(f"Error extracting text from page {page_num} of {file_path}: {str(e)}")
-                    return text
-                
-                # For smaller PDFs, use pdfminer for better quality extraction
-                if num_pages <= EbookProcessor.MAX_PDF_PAGES:
-                    return pdfminer_extract_text(file_path)
+                for page in PDFPage.get_pages(file):
+                    output = io.StringIO()
+                    device = TextConverter(resource_manager, output, laparams=LAParams())
+                    try:
+                        PDFPageInterpreter(resource_manager, device).process_page(page)
+                        text = output.getvalue()
+                        extracted += 1
+                    except MemoryError:
+                        raise
+                    except Exception as e:
+                        logger.warning(f"pdfminer failed on page {page_number} of {file_path}, using PyPDF2: {str(e)}")
+                        text = fallback_page(page_number)
+                    finally:
+                        device.close()
+                    
+                    # pdfminer ends pages with a form feed; keep those for section breaks only
+                    yield text.replace(EbookProcessor.SECTION_BREAK, ' ').rstrip()
+                    page_number += 1
+            complete = True
+        except MemoryError:
+            raise
         except Exception as e:
             logger.error(f"Error extracting text from PDF {file_path}: {str(e)}")
+        
+        if not complete:
+            # Fallback to PyPDF2 for the pages pdfminer did not get to
+            try:
+                if fallback_reader is None:
+                    fallback_reader = PyPDF2.PdfReader(file_path)
+                page_count = len(fallback_reader.pages)
+            except MemoryError:
+                raise
+            except Exception as e:
+                logger.error(f"Fallback extraction failed for PDF {file_path}: {str(e)}")
+                failed += 1
+                page_count = page_number
             
-            # Fallback to PyPDF2 if pdfminer fails
+            for number in range(page_number, page_count):
+                yield fallback_page(number)
+        
+        if failed and not extracted:
+            raise ValueError(f"No page of PDF {file_path} could be extracted")
+    
+    @staticmethod
+    def _iter_epub_chapters(file_path):
+        """Yield (chapter id, text) for each document in the spine of an EPUB.
+        
+        Raises if the book cannot be opened, so it counts as a failed extraction.
+        """
+        book = EpubReader(file_path)
+        
+        with book:
             try:
-                text = ""
-                with open(file_path, 'rb') as file:
-                    reader = PyPDF2.PdfReader(file)
-                    # Limit to MAX_PDF_PAGES to prevent hanging
-                    for page_num in range(min(EbookProcessor.MAX_PDF_PAGES, len(reader.pages))):
-                        try:
-                            text += reader.pages[page_num].extract_text() + "\n"
-                        except:
-                            pass  # Skip pages that cause errors
-                return text
-            except Exception as e2:
-                logger.error(f"Fallback extraction failed for PDF {file_path}: {str(e2)}")
-                return ""
+                yield from book.iter_chapters()
+            except MemoryError:
+                raise
+            except Exception as e:
+                logger.error(f"Error extracting text from EPUB {file_path}: {str(e)}")
     
     @staticmethod
-    def _extract_text_from_epub(file_path):
-        """Extract text content from an EPUB file."""
-        try:
-            book = epub.read_epub(file_path)
-            text = ""
-            
-            for item in book.get_items():
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                    try:
-                        content = item.get_content().decode('utf-8')
-                        # Remove HTML tags
-                        text += re.sub('<[^<]+?>', ' ', content) + "\n"
-                    except:
-                        pass  # Skip items that cause errors
-            
-            return text
-        except Exception as e:
-            logger.error(f"Error extracting text from EPUB {file_path}: {str(e)}")
-            return ""
\ No newline at end of file
+    def _iter_mobi_sections(file_path):
+        """Yield the text of each chapter of a MOBI, AZW or AZW3 file; raises if it cannot be opened."""
+        book = MobiReader(file_path)
+        
+        with book:
+            try:
+                yield from book.iter_sections()
+            except MemoryError:
+                raise
+            except Exception as e:
+                logger.error(f"Error extracting text from MOBI {file_path}: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,110 @@
+import codecs
+import logging
+import posixpath
+import zipfile
+from urllib.parse import unquote
+from xml.etree import ElementTree
+from app.utils.html_text import HtmlTextExtractor
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_PATH = 'META-INF/container.xml'
+DOCUMENT_TYPES = ('application/xhtml+xml', 'text/html', 'application/x-dtbook+xml')
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class EpubReader:
+    """Streaming reader for EPUB books.
+
+    Reads the package document (OPF) straight from the zip archive and walks
+    the spine in reading order, decompressing and converting one document
+    at a time, so the book is never loaded into memory as a whole.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._zip = zipfile.ZipFile(file_path)
+        try:
+            self._read_package()
+        except Exception:
+            self._zip.close()
+            raise
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_package(self):
+        container = ElementTree.fromstring(self._zip.read(CONTAINER_PATH))
+        rootfile = container.find('.//{*}rootfile')
+        if rootfile is None or not rootfile.get('full-path'):
+            raise ValueError(f"EPUB has no package document: {self.file_path}")
+
+        self.package_path = rootfile.get('full-path')
+        package = ElementTree.fromstring(self._zip.read(self.package_path))
+        base = posixpath.dirname(self.package_path)
+
+        self.metadata_element = package.find('{*}metadata')
+
+        # Manifest id -> (archive path, media type)
+        self.manifest = {}
+        manifest = package.find('{*}manifest')
+        for item in manifest.findall('{*}item') if manifest is not None else ():
+            href = item.get('href')
+            if item.get('id') and href:
+                path = posixpath.normpath(posixpath.join(base, unquote(href.split('#', 1)[0])))
+                self.manifest[item.get('id')] = (path, item.get('media-type', ''))
+
+        self.spine = []
+        spine = package.find('{*}spine')
+        for itemref in spine.findall('{*}itemref') if spine is not None else ():
+            idref = itemref.get('idref')
+            if idref in self.manifest and self.manifest[idref][1] in DOCUMENT_TYPES:
+                self.spine.append(idref)
+
+    def metadata(self):
+        """Return the title and first author from the package metadata."""
+        def first_text(tag):
+            if self.metadata_element is None:
+                return None
+            element = self.metadata_element.find(f'{{*}}{tag}')
+            if element is None or not element.text:
+                return None
+            return element.text.strip() or None
+
+        return {'title': first_text('title'), 'author': first_text('creator')}
+
+    def iter_chapters(self):
+        """Yield (chapter id, text) for each document of the spine in reading order."""
+        for item_id in self.spine:
+            path = self.manifest[item_id][0]
+            try:
+                text = self._document_text(path)
+            except KeyError:
+                logger.warning(f"EPUB {self.file_path} lists missing document {path}")
+                continue
+            yield item_id, text
+
+    def _document_text(self, path):
+        """Convert one (X)HTML document to text while it is being decompressed."""
+        extractor = HtmlTextExtractor()
+        decoder = None
+
+        with self._zip.open(path) as document:
+            while True:
+                chunk = document.read(READ_CHUNK_SIZE)
+                if decoder is None:
+                    # EPUB content documents are UTF-8 or UTF-16, the latter always with a BOM
+                    encoding = 'utf-16' if chunk[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE) else 'utf-8-sig'
+                    decoder = codecs.getincrementaldecoder(encoding)('replace')
+                if not chunk:
+                    break
+                extractor.feed(decoder.decode(chunk))
+
+        extractor.feed(decoder.decode(b'', final=True))
+        return '\n'.join(extractor.close())
@@ -0,0 +1,222 @@
+import os
+import time
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    """Raised when a file could not be processed by an extraction worker."""
+
+
+class ExtractionTimeout(ExtractionError):
+    """Raised when processing a file exceeded the wall-clock limit."""
+
+
+def _address_space_size():
+    """Return the virtual memory size of the current process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _worker_main(conn, memory_limit):
+    """Run (func, args) tasks received over a pipe until told to stop.
+
+    Each task is answered with (ok, result or error message, retire), where
+    retire asks the pool to replace this worker.
+    """
+    if memory_limit and resource is not None:
+        # Allow the limit on top of what the worker has already mapped
+        limit = _address_space_size() + memory_limit
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Cannot limit extraction worker memory: {str(e)}")
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            break
+        if task is None:
+            break
+
+        func, args = task
+        try:
+            conn.send((True, func(*args), False))
+        except MemoryError:
+            # The heap may be too fragmented to be useful, so let the pool replace us
+            conn.send((False, 'Memory limit exceeded', True))
+            break
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {str(e)}", False))
+
+
+class _Worker:
+    """One extraction worker process and the pipe to it."""
+
+    def __init__(self, context, memory_limit):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.key = None
+        self.deadline = None
+        self.tasks = 0
+
+    def submit(self, key, func, args, timeout):
+        self.key = key
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.conn.send((func, args))
+
+    def stop(self):
+        """Ask the worker to exit, killing it if it does not."""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """Runs ebook extraction in worker processes under hard limits.
+
+    Unlike a thread that is merely abandoned after a timeout, a worker that
+    exceeds the wall-clock limit is killed, and a worker's address space is
+    capped so a runaway parse fails with a MemoryError instead of exhausting
+    the machine. Workers are replaced after a number of files to reclaim
+    memory that parsers such as pdfminer leave behind.
+
+    The pool only holds its settings; every call to ``imap_unordered`` starts
+    its own workers, so one pool may be shared between threads. Workers are
+    started from a fork server (or spawned where there is none) rather than
+    forked from the application: pools are used from request and scan
+    threads, and a child forked from a multithreaded process can deadlock on
+    locks another thread held at the time of the fork.
+    """
+
+    # Modules the fork server imports once, so that workers start without importing them
+    PRELOAD = ['app.utils.library_scanner', 'app.utils.text_store']
+
+    def __init__(self, workers=1, timeout=60, memory_limit=None, max_tasks_per_worker=50):
+        self.workers = max(1, workers or 1)
+        # Seconds a single file may take before its worker is killed
+        self.timeout = timeout
+        # Bytes of memory a worker may allocate on top of what it inherited
+        self.memory_limit = memory_limit
+        # Files processed by a worker before it is replaced
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._context = self._start_context()
+
+    @classmethod
+    def _start_context(cls):
+        if 'forkserver' not in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context('spawn')
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(cls.PRELOAD)
+        return context
+
+    @classmethod
+    def from_config(cls, config, workers=1):
+        """Create a pool using the extraction limits from the application config."""
+        memory_limit_mb = config.get('EXTRACTION_MEMORY_LIMIT_MB')
+        return cls(
+            workers=workers,
+            timeout=config.get('EXTRACTION_TIMEOUT'),
+            memory_limit=memory_limit_mb * 1024 * 1024 if memory_limit_mb else None,
+            max_tasks_per_worker=config.get('EXTRACTION_MAX_TASKS_PER_WORKER', 50)
+        )
+
+    def run(self, func, *args):
+        """Run one task in a worker process and return its result.
+
+        Raises ExtractionError (or ExtractionTimeout) if the task failed.
+        """
+        for _, result, error in self.imap_unordered(func, [(None, args)]):
+            if error is not None:
+                raise error
+            return result
+
+    def imap_unordered(self, func, tasks):
+        """Run func for every (key, args) task, yielding (key, result, error) as tasks finish.
+
+        Tasks are read lazily, so at most one task per worker is in flight.
+        ``func`` must be a module-level function so it can be sent to the
+        workers. Errors are ExtractionError instances; the result is None then.
+        """
+        tasks = iter(tasks)
+        idle = []
+        busy = []
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and len(busy) < self.workers:
+                    try:
+                        key, args = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    worker = idle.pop() if idle else _Worker(self._context, self.memory_limit)
+                    worker.submit(key, func, args, self.timeout)
+                    busy.append(worker)
+
+                if not busy:
+                    break
+
+                deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+                wait_timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                ready = wait([worker.conn for worker in busy], wait_timeout)
+
+                for worker in list(busy):
+                    if worker.conn in ready:
+                        busy.remove(worker)
+                        try:
+                            ok, value, retire = worker.conn.recv()
+                        except (EOFError, OSError):
+                            # Killed from outside, e.g. by the OOM killer, or crashed in native code
+                            worker.kill()
+                            yield worker.key, None, ExtractionError(
+                                f"Extraction worker exited unexpectedly (exit code {worker.process.exitcode})"
+                            )
+                            continue
+
+                        worker.tasks += 1
+                        if retire or worker.tasks >= self.max_tasks_per_worker:
+                            worker.stop()
+                        else:
+                            idle.append(worker)
+
+                        if ok:
+                            yield worker.key, value, None
+                        else:
+                            yield worker.key, None, ExtractionError(value)
+                    elif (worker.deadline is not None and time.monotonic() >= worker.deadline
+                            and not worker.conn.poll()):
+                        busy.remove(worker)
+                        worker.kill()
+                        yield worker.key, None, ExtractionTimeout(
+                            f"Extraction took longer than {self.timeout:g} seconds and was stopped"
+                        )
+        finally:
+            for worker in busy:
+                worker.kill()
+            for worker in idle:
+                worker.stop()
@@ -0,0 +1,162 @@
+import logging
+from sqlalchemy import text
+from app import db
+from app.utils.query_parser import And, Or, parse_query, to_fts5
+from app.utils.snippets import MAX_SNIPPETS
+
+logger = logging.getLogger(__name__)
+
+
+class FtsIndex:
+    """SQLite FTS5 full-text index over chunked book text.
+
+    Every book is stored as one row per page or chapter. Row ids are derived
+    from the book id (``book_id * CHUNK_STRIDE + chunk``) so all chunks of a
+    book can be found or deleted through the rowid without scanning the table.
+    """
+
+    TABLE_NAME = 'book_text'
+    CHUNK_STRIDE = 1_000_000
+    INSERT_BATCH_SIZE = 100
+
+    @staticmethod
+    def is_available():
+        """Check whether the application database supports FTS5."""
+        return db.engine.dialect.name == 'sqlite'
+
+    @classmethod
+    def create_table(cls):
+        """Create the FTS5 virtual table if it does not exist yet."""
+        if not cls.is_available():
+            logger.warning("FTS5 search requires a SQLite database, skipping full-text table creation")
+            return False
+
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {cls.TABLE_NAME} USING fts5("
+            "content, book_id UNINDEXED, chunk UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        db.session.commit()
+        return True
+
+    @classmethod
+    def _rowid_range(cls, book_id):
+        first = book_id * cls.CHUNK_STRIDE
+        return first, first + cls.CHUNK_STRIDE - 1
+
+    @classmethod
+    def has_book(cls, book_id):
+        """Check whether a book has any text in the index."""
+        first, last = cls._rowid_range(book_id)
+        row = db.session.execute(
+            text(f"SELECT 1 FROM {cls.TABLE_NAME} WHERE rowid BETWEEN :first AND :last LIMIT 1"),
+            {'first': first, 'last': last}
+        ).first()
+        return row is not None
+
+    @classmethod
+    def add_book(cls, book_id, chunks):
+        """Index the chunks (pages or chapters) of a book, replacing old ones.
+        
+        Chunks are consumed lazily and inserted in batches of INSERT_BATCH_SIZE,
+        so a book never has to be held in memory as a whole. The caller
+        commits the session.
+        """
+        first, last = cls._rowid_range(book_id)
+        insert = text(
+            f"INSERT INTO {cls.TABLE_NAME} (rowid, content, book_id, chunk) "
+            "VALUES (:rowid, :content, :book_id, :chunk)"
+        )
+        count = 0
+        
+        db.session.execute(
+            text(f"DELETE FROM {cls.TABLE_NAME} WHERE rowid BETWEEN :first AND :last"),
+            {'first': first, 'last': last}
+        )
+        
+        rows = []
+        for number, content in enumerate(chunks):
+            if number >= cls.CHUNK_STRIDE:
+                break
+            if not content or not content.strip():
+                continue
+            rows.append({'rowid': first + number, 'content': content, 'book_id': book_id, 'chunk': number})
+            if len(rows) >= cls.INSERT_BATCH_SIZE:
+                db.session.execute(insert, rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            db.session.execute(insert, rows)
+            count += len(rows)
+        
+        logger.debug(f"Added {count} chunks for book {book_id} to the FTS5 index")
+    
+    @classmethod
+    def remove_book(cls, book_id):
+        """Remove all chunks of a book from the index. The caller commits the session."""
+        first, last = cls._rowid_range(book_id)
+        db.session.execute(
+            text(f"DELETE FROM {cls.TABLE_NAME} WHERE rowid BETWEEN :first AND :last"),
+            {'first': first, 'last': last}
+        )
+
+    @classmethod
+    def search(cls, query, limit=50, snippets=MAX_SNIPPETS):
+        """Find books matching the query ranked by BM25.
+
+        The query is a query string or a tree from ``parse_query``, translated
+        to an FTS5 MATCH expression. FTS5 matches each page or chapter on its
+        own, so words joined by AND must occur in the same chunk; excluded
+        words at the top of the query exclude the whole book, though.
+
+        A book's relevance is the sum of the BM25 scores of its matching
+        chunks. Returns up to ``limit`` tuples of (book_id, relevance,
+        snippets) where snippets are highlighted {'text', 'page', 'label'}
+        passages from the ``snippets`` best chunks and page is the chunk's
+        1-based page or chapter number. Raises QueryError for an invalid
+        query.
+        """
+        if isinstance(query, str):
+            query = parse_query(query)
+
+        params = {'limit': limit}
+        exclusion = ""
+        if isinstance(query, And) and query.excluded:
+            excluded = query.excluded[0] if len(query.excluded) == 1 else Or(query.excluded)
+            query = query.children[0] if len(query.children) == 1 else And(query.children)
+            exclusion = (
+                f"AND book_id NOT IN (SELECT book_id FROM {cls.TABLE_NAME} "
+                f"WHERE {cls.TABLE_NAME} MATCH :excluded) "
+            )
+            params['excluded'] = to_fts5(excluded)
+
+        match_query = to_fts5(query)
+        params['query'] = match_query
+
+        # The rank column is bm25(), which is lower for better matches, so negate it
+        rows = db.session.execute(
+            text(
+                f"SELECT book_id, -SUM(rank) AS relevance FROM {cls.TABLE_NAME} "
+                f"WHERE {cls.TABLE_NAME} MATCH :query {exclusion}"
+                "GROUP BY book_id ORDER BY relevance DESC LIMIT :limit"
+            ),
+            params
+        ).all()
+
+        results = []
+        for book_id, relevance in rows:
+            first, last = cls._rowid_range(book_id)
+            best = db.session.execute(
+                text(
+                    f"SELECT snippet({cls.TABLE_NAME}, 0, '**', '**', '...', 24), chunk FROM {cls.TABLE_NAME} "
+                    f"WHERE {cls.TABLE_NAME} MATCH :query AND rowid BETWEEN :first AND :last "
+                    "ORDER BY rank LIMIT :snippets"
+                ),
+                {'query': match_query, 'first': first, 'last': last, 'snippets': snippets}
+            ).all()
+            results.append((book_id, relevance, [
+                {'text': snippet or "", 'page': chunk + 1, 'label': None}
+                for snippet, chunk in best
+            ]))
+
+        return results
@@ -0,0 +1,140 @@
+import json
+import queue
+import logging
+import threading
+from sqlalchemy import bindparam
+from app import db
+from app.models.search import SearchResult
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """Saves the results of searches to the search history.
+
+    Searches only insert their own row before responding; the result rows
+    are written afterwards by an in-process worker thread, which executes
+    the queued statements in order, in bulk and in as few transactions as
+    possible. The writes of the same search are therefore applied in the
+    order they were queued, and reads of saved results call ``flush`` first.
+
+    With SEARCH_HISTORY_TOP_K set, only the book ids and scores of the best
+    results of each search are saved.
+    """
+
+    # Most queued writes applied in one transaction
+    BATCH_SIZE = 50
+
+    def __init__(self):
+        self.app = None
+        self.asynchronous = True
+        self.top_k = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Bind the writer to the application whose config and database it uses."""
+        self.app = app
+        self.asynchronous = app.config.get('SEARCH_HISTORY_ASYNC', self.asynchronous)
+        self.top_k = app.config.get('SEARCH_HISTORY_TOP_K', self.top_k)
+
+    def saved_results(self, ranked):
+        """Return the ranked results of a search that are saved to the history."""
+        return ranked[:self.top_k] if self.top_k else ranked
+
+    def save_results(self, search_id, ranked):
+        """Save ranked [book_id, relevance, spans, snippets] items as the results of a search."""
+        rows = []
+        for book_id, relevance, _, snippets in self.saved_results(ranked):
+            if self.top_k:
+                snippets = None
+            rows.append({
+                'search_id': search_id,
+                'book_id': book_id,
+                'relevance_score': relevance,
+                'match_context': snippets[0]['text'] if snippets else None,
+                'page': snippets[0]['page'] if snippets else None,
+                'snippets': json.dumps(snippets) if snippets is not None else None
+            })
+        self._submit(SearchResult.__table__.insert(), rows)
+
+    def save_snippets(self, search_id, items):
+        """Save the snippets built for ranked result items with the results of a search."""
+        if self.top_k:
+            return
+
+        table = SearchResult.__table__
+        statement = table.update().where(
+            table.c.search_id == bindparam('result_search_id'),
+            table.c.book_id == bindparam('result_book_id')
+        ).values(
+            snippets=bindparam('result_snippets'),
+            match_context=bindparam('result_context'),
+            page=bindparam('result_page')
+        )
+        self._submit(statement, [
+            {
+                'result_search_id': search_id,
+                'result_book_id': book_id,
+                'result_snippets': json.dumps(snippets),
+                'result_context': snippets[0]['text'] if snippets else None,
+                'result_page': snippets[0]['page'] if snippets else None
+            }
+            for book_id, _, _, snippets in items
+        ])
+
+    def flush(self):
+        """Wait until every queued write has been applied."""
+        if self.asynchronous:
+            self._queue.join()
+
+    def _submit(self, statement, rows):
+        if not rows:
+            return
+
+        if not self.asynchronous:
+            self._execute([(statement, rows)])
+            return
+
+        self._queue.put((statement, rows))
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            writes = [self._queue.get()]
+            # Apply the writes queued in the meantime in the same transaction
+            while len(writes) < self.BATCH_SIZE:
+                try:
+                    writes.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                with self.app.app_context():
+                    self._execute(writes)
+            except Exception as e:
+                logger.error(f"History writer failed: {str(e)}")
+            finally:
+                for _ in writes:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _execute(writes):
+        """Execute (statement, rows) writes with executemany in one transaction."""
+        try:
+            for statement, rows in writes:
+                db.session.execute(statement, rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving search history: {str(e)}")
+
+
+history_writer = HistoryWriter()
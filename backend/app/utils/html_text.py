@@ -0,0 +1,89 @@
+import re
+from html.parser import HTMLParser
+
+# Tags whose content is never part of the readable text
+SKIPPED_TAGS = {'script', 'style', 'title', 'template', 'svg', 'math'}
+
+# Tags that end a line of text
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure',
+    'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre', 'section',
+    'table', 'td', 'th', 'tr', 'ul'
+}
+
+SPACES = re.compile(r'[^\S\n]+')
+BLANK_LINES = re.compile(r'\s*\n\s*')
+
+
+class HtmlTextExtractor(HTMLParser):
+    """Incremental HTML (or XHTML) to plain text converter.
+
+    Markup can be fed in chunks of any size, including chunks that split a
+    tag. Script and style content is dropped, character references are
+    decoded, and block-level tags become line breaks. Start tags listed in
+    ``section_tags`` (such as MOBI page breaks) begin a new section;
+    completed sections are collected with ``pop_sections``.
+    """
+
+    def __init__(self, section_tags=()):
+        super().__init__(convert_charrefs=True)
+        self.section_tags = set(section_tags)
+        self._parts = []
+        self._sections = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.section_tags:
+            self._end_section()
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closing tags such as <br/> or <mbp:pagebreak/> have no content to skip
+        if tag in self.section_tags:
+            self._end_section()
+        elif tag in BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def _end_section(self):
+        text = self._take_text()
+        if text:
+            self._sections.append(text)
+
+    def _take_text(self):
+        text = ''.join(self._parts)
+        self._parts = []
+        # Collapse whitespace the way a browser would, keeping paragraph breaks as newlines
+        text = SPACES.sub(' ', text)
+        return BLANK_LINES.sub('\n', text).strip()
+
+    def pop_sections(self):
+        """Return the sections completed so far and forget them."""
+        sections = self._sections
+        self._sections = []
+        return sections
+
+    def close(self):
+        """Finish parsing and return the remaining sections."""
+        super().close()
+        self._end_section()
+        return self.pop_sections()
+
+
+def html_to_text(markup):
+    """Convert a complete HTML document to plain text."""
+    extractor = HtmlTextExtractor()
+    extractor.feed(markup)
+    return '\n'.join(extractor.close())
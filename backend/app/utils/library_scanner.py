@@ -1,80 +1,443 @@
 import os
 import logging
+import threading
+from datetime import datetime
 from pathlib import Path
+from flask import current_app
 from app.utils.ebook_processor import EbookProcessor
+from app.utils.extraction_pool import ExtractionPool, ExtractionError
+from app.utils.fts_index import FtsIndex
+from app.utils.text_store import extract_to_store
 from app.models.book import Book
-from app import db
+from app.models.extraction_failure import ExtractionFailure
+from app import db, search_index, text_cache, text_store
 
 logger = logging.getLogger(__name__)
 
+
+def ingest_file(file_path, known_hash, text_store_path):
+    """Hash an ebook and, if its content is new, extract its metadata and text.
+    
+    Runs in an extraction worker process. The text is streamed page by page
+    straight into the text store, so only the metadata is sent back to the
+    scanner.
+    """
+    content_hash = EbookProcessor.compute_file_hash(file_path)
+    if content_hash == known_hash:
+        return {'content_hash': content_hash, 'changed': False}
+    
+    metadata = EbookProcessor.get_metadata_from_file(file_path)
+    
+    extract_to_store(text_store_path, content_hash, file_path)
+    
+    return {
+        'content_hash': content_hash,
+        'changed': True,
+        'title': metadata.get('title'),
+        'author': metadata.get('author')
+    }
+
+
 class LibraryScanner:
     """Utility class for scanning the library directory and indexing ebooks."""
     
-    def __init__(self, library_path, supported_formats=None):
+    # Serializes scans within the process (scan jobs and the library watcher)
+    lock = threading.RLock()
+    
+    def __init__(self, library_path, supported_formats=None, workers=None, batch_size=200, progress=None):
         self.library_path = library_path
-        self.supported_formats = supported_formats or ['pdf', 'epub', 'azw3']
+        self.supported_formats = supported_formats or ['pdf', 'epub', 'azw3', 'azw', 'mobi']
+        # Number of processes extracting metadata and text in parallel
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ExtractionPool.from_config(current_app.config, workers=self.workers)
+        # Failed extractions after which a file is quarantined until it changes
+        self.max_failures = current_app.config.get('EXTRACTION_MAX_FAILURES', 3)
+        self._failures = {}
+        # Number of changed books written per database commit
+        self.batch_size = batch_size
+        # Optional callback receiving (phase, discovered, processed, failed) as the scan advances
+        self.progress = progress
+        self._discovered = 0
+    
+    def scan_library(self, incremental=True):
+        """Scan the library directory and index new or changed ebooks.
+        
+        Known files are compared against the size and modification time
+        recorded at the previous scan; in incremental mode files that match
+        are skipped without being opened, while a full scan re-hashes every
+        file. Books whose files have disappeared are soft-deleted. Returns a
+        summary of the changes.
+        """
+        with self.lock:
+            return self._scan_library(incremental)
     
-    def scan_library(self):
-        """Scan the library directory and index all ebooks."""
-        logger.info(f"Starting library scan at {self.library_path}")
+    def _scan_library(self, incremental):
+        logger.info(f"Starting {'incremental' if incremental else 'full'} library scan at {self.library_path}")
+        
+        summary = self._new_summary()
         
         if not os.path.exists(self.library_path):
             logger.error(f"Library path does not exist: {self.library_path}")
-            return []
+            return summary
         
-        indexed_books = []
+        # Load what is known about every book in a single query
+        known = self._load_records()
+        self._failures = ExtractionFailure.by_path()
+        
+        seen_paths = set()
+        pending = []
         
         for root, _, files in os.walk(self.library_path):
             for file in files:
                 file_path = os.path.join(root, file)
-                file_ext = Path(file_path).suffix.lower().lstrip('.')
+                if not self.is_supported(file_path):
+                    continue
                 
-                if file_ext in self.supported_formats:
-                    try:
-                        # Check if book already exists in database
-                        existing_book = Book.query.filter_by(file_path=file_path).first()
-                        
-                        if existing_book:
-                            logger.debug(f"Book already indexed: {file_path}")
-                            indexed_books.append(existing_book)
-                            continue
-                        
-                        # Extract metadata
-                        metadata = EbookProcessor.get_metadata_from_file(file_path)
-                        
-                        # Create new book record
-                        book = Book(
-                            title=metadata.get('title', Path(file_path).stem),
-                            author=metadata.get('author'),
-                            file_path=file_path,
-                            file_format=file_ext,
-                            file_size=metadata.get('file_size')
-                        )
-                        
-                        db.session.add(book)
-                        indexed_books.append(book)
-                        logger.info(f"Indexed book: {book.title}")
-                    except Exception as e:
-                        logger.error(f"Error indexing book {file_path}: {str(e)}")
+                seen_paths.add(file_path)
+                self._discovered = len(seen_paths)
+                self._check_file(file_path, known.get(file_path), incremental, summary, pending)
+        
+        self._report('scanning', summary)
+        
+        changed_books = self._ingest(pending, summary)
+        
+        # Books under the library path whose files are gone
+        library_prefix = os.path.join(self.library_path, '')
+        vanished_ids = [
+            row.id for path, row in known.items()
+            if row.deleted_at is None and path.startswith(library_prefix) and path not in seen_paths
+        ]
+        summary['removed'] = self.remove_books(vanished_ids)
+        
+        self._commit()
+        
+        if incremental:
+            # Also pick up books that are missing from the index, e.g. after it was rebuilt
+            indexed_ids = search_index.document_ids()
+            changed_ids = {book.id for book in changed_books}
+            missing_ids = [
+                row.id for row in known.values()
+                if row.deleted_at is None and row.id not in indexed_ids and row.id not in changed_ids
+                and row.file_path in seen_paths
+            ]
+            books_to_index = changed_books + self._load_books(missing_ids)
+        else:
+            books_to_index = Book.active().all()
+        
+        reindexed = self.index_books(books_to_index)
+        
+        return self._finish(summary, reindexed)
+    
+    def scan_paths(self, paths):
+        """Bring specific files or directories up to date without walking the library.
+        
+        Existing files are checked like in an incremental scan, existing
+        directories are scanned recursively, and books at or below paths that
+        no longer exist are soft-deleted. Returns a summary of the changes.
+        """
+        with self.lock:
+            summary = self._new_summary()
+            
+            files = set()
+            missing = set()
+            for path in paths:
+                if os.path.isdir(path):
+                    for root, _, names in os.walk(path):
+                        files.update(os.path.join(root, name) for name in names)
+                elif os.path.exists(path):
+                    files.add(path)
+                else:
+                    missing.add(path)
+            files = {path for path in files if self.is_supported(path)}
+            self._discovered = len(files)
+            
+            known = {}
+            file_list = sorted(files)
+            for i in range(0, len(file_list), 500):
+                known.update(self._load_records(Book.file_path.in_(file_list[i:i + 500])))
+            
+            self._failures = ExtractionFailure.by_path()
+            pending = []
+            for file_path in file_list:
+                self._check_file(file_path, known.get(file_path), True, summary, pending)
+            
+            changed_books = self._ingest(pending, summary)
+            
+            # Paths that are gone may be single books or whole directories
+            vanished_ids = []
+            for path in missing:
+                vanished_ids.extend(
+                    row.id for row in self._load_records(
+                        db.or_(Book.file_path == path, Book.file_path.startswith(os.path.join(path, ''), autoescape=True)),
+                        Book.deleted_at.is_(None)
+                    ).values()
+                )
+            summary['removed'] = self.remove_books(vanished_ids)
+            
+            self._commit()
+            reindexed = self.index_books(changed_books)
+            
+            return self._finish(summary, reindexed)
+    
+    def is_supported(self, file_path):
+        """Check whether a file has one of the supported ebook formats."""
+        return Path(file_path).suffix.lower().lstrip('.') in self.supported_formats
+    
+    @staticmethod
+    def _new_summary():
+        return {
+            'added': 0, 'updated': 0, 'restored': 0, 'removed': 0, 'unchanged': 0, 'failed': 0,
+            'quarantined': 0, 'total': 0
+        }
+    
+    @staticmethod
+    def _load_records(*criteria):
+        """Load the recorded state of books as lightweight rows keyed by path."""
+        query = db.session.query(
+            Book.id, Book.file_path, Book.file_size, Book.file_mtime, Book.content_hash, Book.deleted_at
+        )
+        if criteria:
+            query = query.filter(*criteria)
+        return {row.file_path: row for row in query.all()}
+    
+    def _check_file(self, file_path, record, incremental, summary, pending):
+        """Queue a file for processing unless its size and mtime are unchanged."""
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            summary['failed'] += 1
+            logger.error(f"Cannot access {file_path}: {str(e)}")
+            return
+        
+        if (incremental and record is not None and record.deleted_at is None
+                and record.file_size == stat.st_size and record.file_mtime == stat.st_mtime):
+            summary['unchanged'] += 1
+            self._report('scanning', summary)
+            return
         
+        if ExtractionFailure.quarantines(self._failures, file_path, stat.st_size, stat.st_mtime):
+            # Failed too often before; only retried once the file changes
+            summary['quarantined'] += 1
+            self._report('scanning', summary)
+            return
+        
+        pending.append((file_path, stat, record))
+    
+    @staticmethod
+    def _commit():
         # Commit all changes to database
         try:
             db.session.commit()
-            logger.info(f"Indexed {len(indexed_books)} books")
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error committing indexed books to database: {str(e)}")
+            raise
+    
+    def _finish(self, summary, reindexed=0):
+        summary['total'] = Book.active().count()
+        if reindexed or any(summary[change] for change in ('added', 'updated', 'restored', 'removed')):
+            # Cached search results no longer reflect the library
+            search_index.bump_generation()
+        logger.info(
+            f"Library scan finished: {summary['added']} added, {summary['updated']} updated, "
+            f"{summary['restored']} restored, {summary['removed']} removed, {summary['unchanged']} unchanged, "
+            f"{summary['failed']} failed, {summary['quarantined']} quarantined"
+        )
+        return summary
+    
+    def _ingest(self, pending, summary):
+        """Process new and modified files in parallel and record the results.
+        
+        Hashing, metadata and text extraction run in worker processes; their
+        results are streamed back to this process, which is the only writer
+        to the database and commits in batches. Returns the books that need
+        (re)indexing.
+        """
+        changed_books = []
+        uncommitted = 0
+        
+        for (file_path, stat, record), result, error in self._run_workers(pending):
+            if error is not None:
+                summary['failed'] += 1
+                self._report('scanning', summary)
+                logger.error(f"Error indexing book {file_path}: {str(error)}")
+                ExtractionFailure.record(file_path, error, self.max_failures)
+                continue
+            
+            if file_path in self._failures:
+                ExtractionFailure.clear(file_path)
+            
+            try:
+                change, book = self._apply_result(file_path, stat, record, result)
+            except Exception as e:
+                summary['failed'] += 1
+                self._report('scanning', summary)
+                logger.error(f"Error indexing book {file_path}: {str(e)}")
+                continue
+            
+            summary[change] += 1
+            self._report('scanning', summary)
+            if book is not None:
+                changed_books.append(book)
+            
+            uncommitted += 1
+            if uncommitted >= self.batch_size:
+                db.session.commit()
+                uncommitted = 0
+        
+        return changed_books
+    
+    def _run_workers(self, pending):
+        """Yield (item, result, error) for each pending file as workers finish."""
+        tasks = (
+            ((file_path, stat, record), (file_path, record.content_hash if record else None, text_store.path))
+            for file_path, stat, record in pending
+        )
+        yield from self.pool.imap_unordered(ingest_file, tasks)
+    
+    def _apply_result(self, file_path, stat, record, result):
+        """Bring the database record for one file up to date.
+        
+        Returns the kind of change and the book that needs (re)indexing, if any.
+        """
+        if record is None:
+            # Create new book record
+            book = Book(
+                title=result.get('title') or Path(file_path).stem,
+                author=result.get('author'),
+                file_path=file_path,
+                file_format=Path(file_path).suffix.lower().lstrip('.'),
+                file_size=stat.st_size,
+                file_mtime=stat.st_mtime,
+                content_hash=result['content_hash']
+            )
+            db.session.add(book)
+            logger.info(f"Indexed book: {book.title}")
+            return 'added', book
+        
+        restored = record.deleted_at is not None
+        book = db.session.get(Book, record.id)
+        book.file_size = stat.st_size
+        book.file_mtime = stat.st_mtime
+        book.deleted_at = None
+        
+        if not result['changed'] or record.content_hash is None:
+            # Only the timestamp changed (or the hash was never recorded)
+            book.content_hash = result['content_hash']
+            if restored:
+                logger.info(f"Restored book: {book.title}")
+                return 'restored', book
+            return 'unchanged', None
+        
+        # The content changed: refresh metadata and drop the stale index entries
+        book.title = result.get('title') or Path(file_path).stem
+        book.author = result.get('author')
+        book.content_hash = result['content_hash']
+        book.indexed_at = datetime.utcnow()
+        self._unindex_book(book.id)
+        logger.info(f"Re-indexed changed book: {book.title}")
+        return ('restored' if restored else 'updated'), book
+    
+    def _report(self, phase, summary):
+        """Pass scan progress to the progress callback, if any."""
+        if self.progress:
+            processed = sum(summary[key] for key in ('added', 'updated', 'restored', 'unchanged', 'failed', 'quarantined'))
+            self.progress(phase, self._discovered, processed, summary['failed'])
+    
+    def remove_books(self, book_ids):
+        """Soft-delete books whose files are gone and drop them from the indexes."""
+        if not book_ids:
+            return 0
+        
+        now = datetime.utcnow()
+        for book in self._load_books(book_ids):
+            book.deleted_at = now
+            self._unindex_book(book.id)
+            logger.info(f"Removed book whose file is gone: {book.file_path}")
+        
+        return len(book_ids)
+    
+    @staticmethod
+    def _load_books(book_ids, batch_size=500):
+        """Load books by id in batches that stay below SQLite's parameter limit."""
+        books = []
+        for i in range(0, len(book_ids), batch_size):
+            books.extend(Book.query.filter(Book.id.in_(book_ids[i:i + batch_size])).all())
+        return books
+    
+    def _unindex_book(self, book_id):
+        """Drop a book from the full-text indexes and the text cache."""
+        search_index.remove_document(book_id)
+        if FtsIndex.is_available():
+            FtsIndex.remove_book(book_id)
+        text_cache.invalidate(book_id)
+    
+    def index_books(self, books):
+        """Store and index the text of books missing from the text store or indexes.
+        
+        Returns the number of books whose text was (re)indexed.
+        """
+        fts_available = FtsIndex.is_available()
+        indexed = 0
+        reindexed = 0
+        failed = 0
+        
+        for book in books:
+            if self.progress:
+                self.progress('indexing', len(books), indexed + failed, failed)
+            
+            try:
+                if not book.content_hash:
+                    book.content_hash = EbookProcessor.compute_file_hash(book.file_path)
+                    db.session.commit()
+                
+                needs_store = not text_store.has(book.content_hash)
+                needs_index = not search_index.has_document(book.id)
+                needs_fts = fts_available and not FtsIndex.has_book(book.id)
+                if not needs_store and not needs_index and not needs_fts:
+                    indexed += 1
+                    continue
+                
+                if needs_store and ExtractionFailure.quarantines(
+                        self._failures, book.file_path, book.file_size, book.file_mtime):
+                    failed += 1
+                    continue
+                if needs_store:
+                    self.pool.run(extract_to_store, text_store.path, book.content_hash, book.file_path)
+                
+                # Index from the store one section at a time rather than loading the whole text
+                with text_store.open(book.content_hash) as stored:
+                    if needs_index:
+                        search_index.add_document(book.id, stored.iter_sections())
+                    if needs_fts:
+                        FtsIndex.add_book(book.id, stored.iter_sections())
+                db.session.commit()
+                indexed += 1
+                reindexed += 1
+                logger.info(f"Added book to full-text index: {book.title}")
+            except ExtractionError as e:
+                failed += 1
+                logger.error(f"Error extracting text from {book.file_path}: {str(e)}")
+                ExtractionFailure.record(book.file_path, e, self.max_failures)
+                db.session.commit()
+            except Exception as e:
+                failed += 1
+                db.session.rollback()
+                logger.error(f"Error adding book {book.file_path} to full-text index: {str(e)}")
+        
+        if self.progress:
+            self.progress('indexing', len(books), indexed + failed, failed)
         
-        return indexed_books
+        return reindexed
     
     def get_book_by_path(self, file_path):
         """Get a book by its file path."""
-        return Book.query.filter_by(file_path=file_path).first()
+        return Book.active().filter_by(file_path=file_path).first()
     
     def get_books_by_format(self, file_format):
         """Get all books of a specific format."""
-        return Book.query.filter_by(file_format=file_format).all()
+        return Book.active().filter_by(file_format=file_format).all()
     
     def get_all_books(self):
         """Get all indexed books."""
-        return Book.query.all() 
\ No newline at end of file
+        return Book.active().all() 
\ No newline at end of file
@@ -0,0 +1,311 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+from app.utils.library_scanner import LibraryScanner
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# inotify event flags from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyBackend:
+    """Recursive directory watcher built on Linux inotify through ctypes."""
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._paths_by_watch = {}
+        self.add_tree(root)
+
+    def add_tree(self, root):
+        """Watch a directory and every directory below it."""
+        for directory, _, _ in os.walk(root):
+            self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        watch = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if watch < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logger.error("inotify watch limit reached; raise fs.inotify.max_user_watches to watch the whole library")
+            else:
+                logger.error(f"Cannot watch {directory}: {os.strerror(error)}")
+            return
+        self._paths_by_watch[watch] = directory
+
+    def read_events(self, timeout):
+        """Wait up to timeout seconds and return (kind, path) events.
+
+        Kinds are 'changed' and 'deleted' for paths that must be rescanned or
+        removed, and 'overflow' when events were lost and a full scan is due.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            watch, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append(('overflow', None))
+                continue
+            if mask & IN_IGNORED:
+                self._paths_by_watch.pop(watch, None)
+                continue
+
+            directory = self._paths_by_watch.get(watch)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append(('deleted', path))
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # New directories may already contain files, e.g. when moved in
+                    self.add_tree(path)
+                    events.append(('changed', path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB):
+                events.append(('changed', path))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """Portable watcher that periodically compares file sizes and mtimes."""
+
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+        self._next_poll = time.monotonic() + interval
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime)
+        return snapshot
+
+    def read_events(self, timeout):
+        """Sleep until the next poll (or timeout) and return (kind, path) events."""
+        wait = self._next_poll - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if time.monotonic() < self._next_poll:
+                return []
+
+        self._next_poll = time.monotonic() + self.interval
+        snapshot = self._take_snapshot()
+        events = [('changed', path) for path, state in snapshot.items() if self._snapshot.get(path) != state]
+        events.extend(('deleted', path) for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return events
+
+    def close(self):
+        pass
+
+
+class LibraryWatcher:
+    """Watches the library directory and feeds changes to the LibraryScanner.
+
+    Uses inotify on Linux and falls back to polling elsewhere. Bursts of
+    events, such as a bulk copy into the library, are debounced: changes are
+    applied once no new event has arrived for the debounce interval (or the
+    burst has lasted ten intervals), so each file is processed once. Changes
+    that fail to apply, e.g. while the database is locked, are kept and
+    retried with an increasing delay.
+    """
+
+    # Seconds before failed changes are first retried, doubling up to MAX_RETRY_DELAY
+    RETRY_DELAY = 5.0
+    MAX_RETRY_DELAY = 300.0
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock_file = None
+
+    def init_app(self, app):
+        """Bind the watcher to the application whose config and database it uses."""
+        self.app = app
+
+    def start(self):
+        """Start watching in a background thread unless another process already is."""
+        if self._thread and self._thread.is_alive():
+            return False
+        if not self._acquire_process_lock():
+            logger.info("Library watcher is already running in another process")
+            return False
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stop watching and wait for the watcher thread to exit."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _acquire_process_lock(self):
+        """Make sure only one process per instance folder watches the library."""
+        if fcntl is None:
+            return True
+
+        lock_path = os.path.join(self.app.instance_path, 'library_watcher.lock')
+        lock_file = open(lock_path, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        return True
+
+    def _create_backend(self, library_path):
+        if sys.platform.startswith('linux') and not self.app.config['WATCH_FORCE_POLLING']:
+            try:
+                return InotifyBackend(library_path)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify is unavailable ({str(e)}), falling back to polling")
+        return PollingBackend(library_path, self.app.config['WATCH_POLL_INTERVAL'])
+
+    def _next_retry_delay(self, delay):
+        return min(delay * 2, self.MAX_RETRY_DELAY) if delay else self.RETRY_DELAY
+
+    def _run(self):
+        library_path = self.app.config['LIBRARY_PATH']
+        os.makedirs(library_path, exist_ok=True)
+        debounce = self.app.config['WATCH_DEBOUNCE_SECONDS']
+
+        backend = self._create_backend(library_path)
+        logger.info(f"Watching {library_path} for changes using {type(backend).__name__}")
+
+        pending = set()
+        full_scan = False
+        first_event = last_event = None
+        read_delay = retry_delay = 0
+        retry_at = None
+
+        try:
+            while not self._stop.is_set():
+                timeout = debounce if pending or full_scan else 1.0
+                try:
+                    events = backend.read_events(timeout)
+                    read_delay = 0
+                except Exception as e:
+                    read_delay = self._next_retry_delay(read_delay)
+                    logger.error(f"Error reading library changes, retrying in {read_delay:.0f}s: {str(e)}")
+                    self._stop.wait(read_delay)
+                    continue
+
+                for kind, path in events:
+                    now = time.monotonic()
+                    first_event = first_event or now
+                    last_event = now
+                    if kind == 'overflow':
+                        full_scan = True
+                    else:
+                        pending.add(path)
+
+                if not pending and not full_scan:
+                    continue
+
+                now = time.monotonic()
+                if retry_at is not None and now < retry_at:
+                    continue
+                if retry_at is None and now - last_event < debounce and now - first_event < debounce * 10:
+                    continue
+
+                if not self._apply(pending, full_scan):
+                    # Keep the changes, and those arriving meanwhile, for the next attempt
+                    retry_delay = self._next_retry_delay(retry_delay)
+                    retry_at = now + retry_delay
+                    logger.warning(f"Retrying {len(pending)} library changes in {retry_delay:.0f}s")
+                    continue
+
+                pending = set()
+                full_scan = False
+                first_event = last_event = retry_at = None
+                retry_delay = 0
+        except Exception as e:
+            logger.error(f"Library watcher stopped: {str(e)}")
+        finally:
+            backend.close()
+
+    def _apply(self, paths, full_scan):
+        """Feed collected changes into the scanner, returning whether they were applied."""
+        config = self.app.config
+        try:
+            with self.app.app_context():
+                scanner = LibraryScanner(
+                    config['LIBRARY_PATH'],
+                    config['SUPPORTED_FORMATS'],
+                    workers=config['SCAN_WORKERS'],
+                    batch_size=config['SCAN_BATCH_SIZE']
+                )
+                if full_scan:
+                    logger.warning("Library watcher lost events, running an incremental scan")
+                    scanner.scan_library(incremental=True)
+                else:
+                    logger.info(f"Library watcher applying {len(paths)} changed paths")
+                    scanner.scan_paths(paths)
+            return True
+        except Exception as e:
+            logger.error(f"Error applying library changes: {str(e)}")
+            return False
+
+
+library_watcher = LibraryWatcher()
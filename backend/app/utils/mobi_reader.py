@@ -0,0 +1,325 @@
+import codecs
+import struct
+import logging
+from app.utils.html_text import HtmlTextExtractor
+
+logger = logging.getLogger(__name__)
+
+# PalmDOC compression types from the record 0 header
+NO_COMPRESSION = 1
+PALMDOC_COMPRESSION = 2
+HUFF_CDIC_COMPRESSION = 17480
+
+# MOBI text encodings
+TEXT_ENCODINGS = {1252: 'cp1252', 65001: 'utf-8'}
+
+# EXTH record types
+EXTH_AUTHOR = 100
+EXTH_UPDATED_TITLE = 503
+
+# Markup that starts a new chapter: MOBI page breaks and, in KF8, the body of each part
+SECTION_TAGS = ('mbp:pagebreak', 'body')
+
+
+def palmdoc_decompress(data):
+    """Decompress one PalmDOC (LZ77 variant) compressed record."""
+    output = bytearray()
+    i = 0
+    length = len(data)
+
+    while i < length:
+        byte = data[i]
+        i += 1
+
+        if byte == 0 or 0x09 <= byte <= 0x7F:
+            # Literal byte
+            output.append(byte)
+        elif byte <= 0x08:
+            # The next 1-8 bytes are literals
+            output += data[i:i + byte]
+            i += byte
+        elif byte >= 0xC0:
+            # A space followed by a character
+            output.append(0x20)
+            output.append(byte ^ 0x80)
+        else:
+            # Back reference: 11 bits of distance and 3 bits of length
+            if i >= length:
+                break
+            pair = (byte << 8) | data[i]
+            i += 1
+            distance = (pair >> 3) & 0x7FF
+            count = (pair & 0x07) + 3
+            if distance == 0 or distance > len(output):
+                continue
+            start = len(output) - distance
+            if distance >= count:
+                output += output[start:start + count]
+            else:
+                # Overlapping copy repeats the bytes being written
+                for offset in range(count):
+                    output.append(output[start + offset])
+
+    return bytes(output)
+
+
+class HuffCdicDecoder:
+    """Decoder for HUFF/CDIC compressed MOBI text records.
+
+    The HUFF record holds a canonical Huffman code table and the CDIC records
+    hold the phrase dictionary the codes refer to. Phrases may themselves be
+    compressed and are decoded on first use.
+    """
+
+    def __init__(self, huff_record, cdic_records):
+        if huff_record[:8] != b'HUFF\x00\x00\x00\x18':
+            raise ValueError("Invalid HUFF record")
+
+        cache_offset, base_offset = struct.unpack_from('>LL', huff_record, 8)
+
+        # Lookup by the first 8 bits of a code: (code length, terminal, max code)
+        self.lookup = []
+        for value in struct.unpack_from('>256L', huff_record, cache_offset):
+            code_length = value & 0x1F
+            if code_length == 0:
+                raise ValueError("Invalid HUFF code length")
+            max_code = (((value >> 8) + 1) << (32 - code_length)) - 1
+            self.lookup.append((code_length, bool(value & 0x80), max_code))
+
+        # Per code length bounds used for codes longer than 8 bits
+        bounds = struct.unpack_from('>64L', huff_record, base_offset)
+        self.min_codes = [0] + [bounds[i * 2] << (32 - length) for i, length in enumerate(range(1, 33))]
+        self.max_codes = [0] + [
+            ((bounds[i * 2 + 1] + 1) << (32 - length)) - 1 for i, length in enumerate(range(1, 33))
+        ]
+
+        self.phrases = []
+        for cdic in cdic_records:
+            if cdic[:8] != b'CDIC\x00\x00\x00\x10':
+                raise ValueError("Invalid CDIC record")
+            phrase_count, code_bits = struct.unpack_from('>LL', cdic, 8)
+            count = min(1 << code_bits, phrase_count - len(self.phrases))
+            for offset in struct.unpack_from(f'>{count}H', cdic, 16):
+                header, = struct.unpack_from('>H', cdic, 16 + offset)
+                phrase = cdic[18 + offset:18 + offset + (header & 0x7FFF)]
+                # The high bit marks phrases that are stored uncompressed
+                self.phrases.append([phrase, bool(header & 0x8000)])
+
+    def decode(self, data, depth=0):
+        """Decompress one record (or one compressed phrase)."""
+        if depth > 32:
+            raise ValueError("HUFF/CDIC phrases nest too deeply")
+
+        bits_left = len(data) * 8
+        data = bytes(data) + b'\x00' * 8
+        position = 0
+        window, = struct.unpack_from('>Q', data, position)
+        shift = 32
+        output = []
+
+        while True:
+            if shift <= 0:
+                position += 4
+                window, = struct.unpack_from('>Q', data, position)
+                shift += 32
+            code = (window >> shift) & 0xFFFFFFFF
+
+            code_length, terminal, max_code = self.lookup[code >> 24]
+            if not terminal:
+                while code < self.min_codes[code_length]:
+                    code_length += 1
+                max_code = self.max_codes[code_length]
+
+            shift -= code_length
+            bits_left -= code_length
+            if bits_left < 0:
+                break
+
+            entry = self.phrases[(max_code - code) >> (32 - code_length)]
+            if not entry[1]:
+                entry[0] = self.decode(entry[0], depth + 1)
+                entry[1] = True
+            output.append(entry[0])
+
+        return b''.join(output)
+
+
+class MobiReader:
+    """Pure-Python reader for MOBI, AZW and AZW3 (KF8) ebooks.
+
+    Only the PalmDB record table and the headers are read up front; text
+    records are read and decompressed one at a time as the text is
+    iterated. DRM-protected books cannot be read.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            self._read_headers()
+        except Exception:
+            self._file.close()
+            raise
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_headers(self):
+        header = self._file.read(78)
+        if len(header) < 78:
+            raise ValueError(f"Not a MOBI file: {self.file_path}")
+
+        self.name = header[:32].split(b'\x00', 1)[0].decode('cp1252', 'replace')
+        book_type = header[60:68]
+        if book_type not in (b'BOOKMOBI', b'TEXtREAd'):
+            raise ValueError(f"Not a MOBI file: {self.file_path}")
+
+        record_count, = struct.unpack_from('>H', header, 76)
+        table = self._file.read(record_count * 8)
+        self._file.seek(0, 2)
+        file_size = self._file.tell()
+        starts = [struct.unpack_from('>L', table, i * 8)[0] for i in range(record_count)]
+        self._records = list(zip(starts, starts[1:] + [file_size]))
+
+        # Joint MOBI/KF8 files start with the MOBI rendition, whose text is stored in reading order
+        self._parse_book_header(0)
+
+    def _parse_book_header(self, base):
+        """Read the PalmDOC, MOBI and EXTH headers of the book starting at a record."""
+        record = self.read_record(base)
+        self.base = base
+        self.compression, _, self.text_length, self.text_record_count, _, encryption = struct.unpack_from(
+            '>HHLHHH', record, 0
+        )
+        if encryption:
+            raise ValueError(f"DRM-protected ebooks are not supported: {self.file_path}")
+
+        self.encoding = 'cp1252'
+        self.extra_flags = 0
+        self.huff_record = self.huff_record_count = 0
+        self.title = self.name
+        self.exth = {}
+
+        if record[16:20] != b'MOBI':
+            # Plain PalmDOC book
+            return
+
+        header_length, _, encoding = struct.unpack_from('>LLL', record, 20)
+        self.encoding = TEXT_ENCODINGS.get(encoding, 'cp1252')
+
+        name_offset, name_length = struct.unpack_from('>LL', record, 84)
+        if name_length:
+            self.title = record[name_offset:name_offset + name_length].decode(self.encoding, 'replace')
+
+        self.huff_record, self.huff_record_count = struct.unpack_from('>LL', record, 112)
+        exth_flags, = struct.unpack_from('>L', record, 128)
+        if header_length >= 0xE4:
+            self.extra_flags, = struct.unpack_from('>H', record, 0xF2)
+
+        if exth_flags & 0x40:
+            self.exth = self._parse_exth(record, 16 + header_length)
+
+    @staticmethod
+    def _parse_exth(record, offset):
+        """Return {record type: [values]} from an EXTH header."""
+        exth = {}
+        if record[offset:offset + 4] != b'EXTH':
+            return exth
+
+        _, count = struct.unpack_from('>LL', record, offset + 4)
+        position = offset + 12
+        for _ in range(count):
+            if position + 8 > len(record):
+                break
+            record_type, length = struct.unpack_from('>LL', record, position)
+            if length < 8:
+                break
+            exth.setdefault(record_type, []).append(record[position + 8:position + length])
+            position += length
+        return exth
+
+    def read_record(self, index):
+        """Read the raw bytes of a PalmDB record."""
+        start, end = self._records[index]
+        self._file.seek(start)
+        return self._file.read(end - start)
+
+    def metadata(self):
+        """Return the title and author recorded in the book headers."""
+        def exth_text(record_type):
+            values = self.exth.get(record_type)
+            if not values:
+                return None
+            return values[0].decode(self.encoding, 'replace').strip() or None
+
+        return {
+            'title': exth_text(EXTH_UPDATED_TITLE) or self.title or None,
+            'author': exth_text(EXTH_AUTHOR)
+        }
+
+    def _trailing_size(self, record):
+        """Size of the trailing entries the extra data flags append to a text record."""
+        size = 0
+        flags = self.extra_flags >> 1
+        while flags:
+            if flags & 1:
+                # Backward-encoded variable width integer at the end of the remaining data
+                value = 0
+                shift = 0
+                position = len(record) - size
+                while position > 0:
+                    byte = record[position - 1]
+                    value |= (byte & 0x7F) << shift
+                    shift += 7
+                    position -= 1
+                    if byte & 0x80 or shift >= 28:
+                        break
+                size += value
+            flags >>= 1
+        if self.extra_flags & 1 and len(record) > size:
+            # Multibyte character overlap
+            size += (record[len(record) - size - 1] & 0x03) + 1
+        return size
+
+    def iter_raw_text(self):
+        """Yield the decompressed bytes of each text record in order."""
+        decoder = None
+        if self.compression == HUFF_CDIC_COMPRESSION:
+            first = self.base + self.huff_record
+            decoder = HuffCdicDecoder(
+                self.read_record(first),
+                [self.read_record(first + i) for i in range(1, self.huff_record_count)]
+            )
+        elif self.compression not in (NO_COMPRESSION, PALMDOC_COMPRESSION):
+            raise ValueError(f"Unknown MOBI compression {self.compression} in {self.file_path}")
+
+        for index in range(self.base + 1, min(self.base + 1 + self.text_record_count, len(self._records))):
+            record = self.read_record(index)
+            trailing = self._trailing_size(record)
+            if trailing:
+                record = record[:len(record) - trailing]
+
+            if self.compression == PALMDOC_COMPRESSION:
+                yield palmdoc_decompress(record)
+            elif decoder is not None:
+                yield decoder.decode(record)
+            else:
+                yield record
+
+    def iter_sections(self):
+        """Yield the plain text of each chapter, decoding one record at a time."""
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        extractor = HtmlTextExtractor(SECTION_TAGS)
+
+        for raw in self.iter_raw_text():
+            extractor.feed(decoder.decode(raw))
+            yield from extractor.pop_sections()
+
+        extractor.feed(decoder.decode(b'', final=True))
+        yield from extractor.close()
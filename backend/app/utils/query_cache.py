@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class QueryResultCache:
+    """Process-wide cache of ranked search results shared by all users.
+
+    Entries are keyed by the normalized query and the search options, and
+    are only valid for the library generation they were computed in: when
+    a scan changes the library the generation moves on and every cached
+    ranking is dropped. Entries also expire after ``ttl`` seconds and the
+    least recently used ones are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        """Configure the cache size and lifetime from the application config."""
+        self.max_entries = app.config.get('SEARCH_QUERY_CACHE_SIZE', self.max_entries)
+        self.ttl = app.config.get('SEARCH_QUERY_CACHE_TTL', self.ttl)
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key, generation):
+        """Return the cached results for a key in a library generation, or None."""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, results = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return results
+
+    def put(self, key, generation, results):
+        """Cache results for a key, evicting the least recently used entries as needed."""
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = (time.monotonic() + self.ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached results."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return usage counters for the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'generation': self._generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,444 @@
+import bisect
+import heapq
+import logging
+from array import array
+from app.utils.query_parser import QueryError, Term, Prefix, Phrase, Near, And, Or
+from app.utils.ranking import bm25_scores
+from app.utils.tokenizer import tokenize_sections
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of index terms a prefix query may expand to
+MAX_PREFIX_EXPANSIONS = 200
+
+# Candidates whose exact frequencies are first fetched and scored together when ranking
+SCORE_BLOCK_SIZE = 256
+
+# Read all frequencies of a word, rather than those of a block of books, once
+# the block holds at least this fraction of the books containing it
+RANGE_READ_FRACTION = 0.25
+
+
+def gallop(values, target, low=0):
+    """Return the index of the first value >= target at or after ``low``.
+
+    Probes ahead in exponentially growing steps before bisecting, so walking
+    a long sorted list in small increments costs O(log distance) per step
+    rather than O(log n), and skips over long runs of non-matching values.
+    """
+    size = len(values)
+    if low >= size or values[low] >= target:
+        return low
+
+    step = 1
+    high = low + 1
+    while high < size and values[high] < target:
+        low = high
+        step *= 2
+        high = low + step
+    return bisect.bisect_left(values, target, low + 1, min(high, size))
+
+
+def intersect(first, second):
+    """Intersect two sorted lists by galloping through the longer one."""
+    if len(first) > len(second):
+        first, second = second, first
+
+    result = []
+    index = 0
+    for value in first:
+        index = gallop(second, value, index)
+        if index == len(second):
+            break
+        if second[index] == value:
+            result.append(value)
+    return result
+
+
+def union(lists):
+    """Merge sorted lists into one sorted list without duplicates."""
+    return list(dict.fromkeys(heapq.merge(*lists)))
+
+
+def query_words(node):
+    """Return the set of words and the set of prefixes a query refers to."""
+    words = set()
+    prefixes = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Term):
+            words.add(node.text)
+        elif isinstance(node, Prefix):
+            prefixes.add(node.text)
+        elif isinstance(node, Phrase):
+            words.update(node.terms)
+        elif isinstance(node, Near):
+            stack.extend((node.left, node.right))
+        elif isinstance(node, And):
+            stack.extend(node.children)
+            stack.extend(node.excluded)
+        elif isinstance(node, Or):
+            stack.extend(node.children)
+    return words, prefixes
+
+
+class DocumentPostings:
+    """In-memory positional postings of a single document.
+
+    Only the words (and prefixes) used by the query are collected, so a long
+    text can be streamed section by section without building a full index
+    of it. Implements the postings source interface of QueryExecutor.
+    """
+
+    def __init__(self, book_id, sections, node):
+        self.book_id = book_id
+        words, prefixes = query_words(node)
+        prefixes = tuple(prefixes)
+        self.postings = {}
+        self.length = 0
+
+        for position, offset, term in tokenize_sections(sections):
+            self.length = position + 1
+            if term in words or (prefixes and term.startswith(prefixes)):
+                positions, offsets = self.postings.setdefault(term, (array('I'), array('I')))
+                positions.append(position)
+                offsets.append(offset)
+
+    def book_ids(self, term):
+        return [self.book_id] if term in self.postings else []
+
+    def positions(self, term, book_id):
+        return self.postings.get(term) or (array('I'), array('I'))
+
+    def frequencies(self, term, book_ids=None):
+        if term not in self.postings or (book_ids is not None and self.book_id not in book_ids):
+            return {}
+        return {self.book_id: len(self.postings[term][0])}
+
+    def max_frequency(self, term):
+        return len(self.postings[term][0]) if term in self.postings else 0
+
+    def expand_prefix(self, prefix, limit):
+        return sorted(term for term in self.postings if term.startswith(prefix))[:limit]
+
+
+class QueryExecutor:
+    """Evaluates a parsed query against positional postings.
+
+    The postings source provides ``book_ids(term)`` (sorted ids of the books
+    containing a word), ``positions(term, book_id)`` (parallel arrays of the
+    word's token positions and character offsets in a book) and
+    ``expand_prefix(prefix, limit)`` (the indexed words starting with a
+    prefix, in order). Ranked retrieval with ``top_k`` also needs
+    ``frequencies(term, book_ids=None)``, mapping the given books (or all
+    books) containing a word to its number of occurrences, and ``max_frequency(term)``,
+    an upper bound of its number of occurrences in any one book.
+
+    Evaluation runs in two stages. Candidate books are found from the book
+    lists alone, intersecting the shortest lists first; positions are then
+    only read for the candidates, to check phrases, proximity and
+    exclusions. Matches are reported as spans of (start position, end
+    position, start offset, offset of the last word).
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._expansions = {}
+        self._postings = {}
+        self._book_lists = {}
+        self._frequencies = {}
+
+    def execute(self, node):
+        """Return (book_id, match count, matches) for every matching book.
+
+        Matches are the (offset of the first word, offset of the last word)
+        of each match in order. Where a match ends depends on the length of
+        its last word in the original text, which the postings do not hold.
+        """
+        matches = []
+        for book_id in self.candidates(node):
+            # Positions are only reused within a book, so do not keep them around
+            self._postings = {}
+            spans = self.spans(node, book_id)
+            if spans:
+                matches.append((book_id, len(spans), self._character_spans(spans)))
+        self._postings = {}
+        return matches
+
+    @staticmethod
+    def _character_spans(spans):
+        return [(span[2], span[3]) for span in spans]
+
+    def top_k(self, node, limit, statistics):
+        """Return the ``limit`` best (book_id, relevance, matches) results, best first.
+
+        Relevance is the BM25 score of a book for the words of the query,
+        excluding the words it must not contain. ``statistics`` describes
+        the library: its ``document_count``, the ``average_length`` of its
+        books and their ``lengths(book_ids)`` as a NumPy array.
+
+        Candidates are ranked with MaxScore. The upper bound of a candidate
+        is its BM25 score if every query word it contains occurred as often
+        as the word's maximum frequency in any book, computed for all
+        candidates at once from the book lists and lengths alone. Exact
+        frequencies are then fetched and scored in growing blocks, best bound first,
+        and the best scored candidate is checked for phrases, proximity and
+        exclusions once no unscored bound reaches its score. Candidates whose
+        bound stays below the ``limit`` best matches are never scored.
+        """
+        candidates = self.candidates(node)
+        if limit <= 0 or not candidates:
+            return []
+
+        # NumPy is only needed for ranking, so it is not loaded at startup
+        import numpy as np
+
+        terms = self.scored_terms(node)
+        book_ids = np.asarray(candidates, dtype=np.int64)
+        lengths = statistics.lengths(book_ids)
+        document_frequencies = np.array([len(self._book_ids(term)) for term in terms], dtype=np.float64)
+
+        def score(frequencies, rows):
+            return bm25_scores(
+                frequencies,
+                lengths[rows],
+                document_frequencies,
+                statistics.document_count,
+                statistics.average_length
+            )
+
+        bounds = score(self.bound_matrix(terms, book_ids), slice(None))
+        # Best bound first; equal scores go to the lower book id, as with a stable sort
+        order = np.lexsort((book_ids, -bounds))
+        block_size = max(limit, SCORE_BLOCK_SIZE)
+
+        results = []
+        scored = []
+        next_row = 0
+        checked = 0
+        while len(results) < limit:
+            # Score more candidates while one of them could beat the best scored one
+            while next_row < len(order) and (not scored or -scored[0][0] <= bounds[order[next_row]]):
+                rows = np.sort(order[next_row:next_row + block_size])
+                next_row += len(rows)
+                # Larger blocks each time, so a long search takes few rounds of lookups
+                block_size *= 2
+                scores = score(self.term_frequency_matrix(terms, book_ids[rows]), rows)
+                for book_id, book_score in zip(book_ids[rows].tolist(), scores.tolist()):
+                    heapq.heappush(scored, (-book_score, book_id))
+            if not scored:
+                break
+
+            negated_score, book_id = heapq.heappop(scored)
+            checked += 1
+            self._postings = {}
+            spans = self.spans(node, book_id)
+            if spans:
+                results.append((book_id, -negated_score, self._character_spans(spans)))
+        self._postings = {}
+
+        logger.debug(
+            f"Scored {next_row} and checked positions of {checked} of {len(candidates)} "
+            f"candidate books for the top {limit}"
+        )
+        return results
+
+    def _book_ids(self, term):
+        if term not in self._book_lists:
+            self._book_lists[term] = self.source.book_ids(term)
+        return self._book_lists[term]
+
+    def bound_matrix(self, terms, book_ids):
+        """Return the maximum frequencies of words as a (books x words) matrix.
+
+        ``book_ids`` is a sorted NumPy array. A book has the maximum frequency
+        of every word it contains, and zero for the others.
+        """
+        import numpy as np
+
+        matrix = np.zeros((len(book_ids), len(terms)))
+        for column, term in enumerate(terms):
+            term_book_ids = np.asarray(self._book_ids(term), dtype=np.int64)
+            self._place(matrix, column, book_ids, term_book_ids, self.source.max_frequency(term))
+        return matrix
+
+    def term_frequency_matrix(self, terms, book_ids):
+        """Return the frequencies of words in books as a (books x words) matrix.
+
+        ``book_ids`` is a sorted NumPy array. The frequencies of these books
+        are looked up one by one, unless they are a large part of the books
+        containing a word, whose frequencies are then all read and kept.
+        """
+        import numpy as np
+
+        matrix = np.zeros((len(book_ids), len(terms)))
+        for column, term in enumerate(terms):
+            if term in self._frequencies:
+                frequencies = self._frequencies[term]
+            elif len(book_ids) >= RANGE_READ_FRACTION * len(self._book_ids(term)):
+                frequencies = self._frequencies[term] = self.source.frequencies(term)
+            else:
+                frequencies = self.source.frequencies(term, book_ids.tolist())
+            if not frequencies:
+                continue
+
+            term_book_ids = np.fromiter(frequencies.keys(), dtype=np.int64, count=len(frequencies))
+            counts = np.fromiter(frequencies.values(), dtype=np.float64, count=len(frequencies))
+            self._place(matrix, column, book_ids, term_book_ids, counts)
+        return matrix
+
+    @staticmethod
+    def _place(matrix, column, book_ids, term_book_ids, values):
+        # Place the values of a word's books in the rows of the candidates among them
+        import numpy as np
+
+        values = np.broadcast_to(values, term_book_ids.shape)
+        rows = np.searchsorted(book_ids, term_book_ids)
+        found = rows < len(book_ids)
+        found[found] = book_ids[rows[found]] == term_book_ids[found]
+        matrix[rows[found], column] = values[found]
+
+    def scored_terms(self, node):
+        """Return the sorted words whose frequencies count towards the score of a query node."""
+        if isinstance(node, Term):
+            return [node.text]
+        if isinstance(node, Prefix):
+            return list(self._expand(node.text))
+        if isinstance(node, Phrase):
+            return sorted(set(node.terms))
+        if isinstance(node, Near):
+            return sorted(set(self.scored_terms(node.left)) | set(self.scored_terms(node.right)))
+        if isinstance(node, (And, Or)):
+            # Excluded words are not scored
+            return sorted({term for child in node.children for term in self.scored_terms(child)})
+        raise QueryError(f"Cannot evaluate {node!r}")
+
+    def _expand(self, prefix):
+        if prefix not in self._expansions:
+            terms = self.source.expand_prefix(prefix, MAX_PREFIX_EXPANSIONS + 1)
+            if len(terms) > MAX_PREFIX_EXPANSIONS:
+                raise QueryError(f"'{prefix}*' matches too many words, use a longer prefix")
+            self._expansions[prefix] = terms
+        return self._expansions[prefix]
+
+    def candidates(self, node):
+        """Return the sorted ids of books that may match, judging by the words they contain."""
+        if isinstance(node, Term):
+            return self._book_ids(node.text)
+        if isinstance(node, Prefix):
+            return union(self._book_ids(term) for term in self._expand(node.text))
+        if isinstance(node, Phrase):
+            return self._intersect_all([self._book_ids(term) for term in set(node.terms)])
+        if isinstance(node, Near):
+            return self._intersect_all([self.candidates(node.left), self.candidates(node.right)])
+        if isinstance(node, And):
+            if not node.children:
+                raise QueryError("A query needs at least one word that is not excluded")
+            return self._intersect_all([self.candidates(child) for child in node.children])
+        if isinstance(node, Or):
+            return union(self.candidates(child) for child in node.children)
+        raise QueryError(f"Cannot evaluate {node!r}")
+
+    @staticmethod
+    def _intersect_all(lists):
+        # Start from the rarest list so the intermediate results stay small
+        lists = sorted(lists, key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            if not result:
+                break
+            result = intersect(result, other)
+        return result
+
+    def _term_postings(self, term, book_id):
+        key = (term, book_id)
+        if key not in self._postings:
+            self._postings[key] = self.source.positions(term, book_id)
+        return self._postings[key]
+
+    def spans(self, node, book_id):
+        """Return the matches of a query node in one book, ordered by position."""
+        if isinstance(node, Term):
+            return self._term_spans(node.text, book_id)
+        if isinstance(node, Prefix):
+            return list(heapq.merge(*(self._term_spans(term, book_id) for term in self._expand(node.text))))
+        if isinstance(node, Phrase):
+            return self._phrase_spans(node.terms, book_id)
+        if isinstance(node, Near):
+            return self._near_spans(node, book_id)
+        if isinstance(node, And):
+            child_spans = []
+            for child in node.children:
+                spans = self.spans(child, book_id)
+                if not spans:
+                    return []
+                child_spans.append(spans)
+            if any(self.spans(excluded, book_id) for excluded in node.excluded):
+                return []
+            return list(heapq.merge(*child_spans))
+        if isinstance(node, Or):
+            return list(dict.fromkeys(heapq.merge(*(self.spans(child, book_id) for child in node.children))))
+        raise QueryError(f"Cannot evaluate {node!r}")
+
+    def _term_spans(self, term, book_id):
+        positions, offsets = self._term_postings(term, book_id)
+        return [(position, position, offset, offset) for position, offset in zip(positions, offsets)]
+
+    def _phrase_spans(self, terms, book_id):
+        postings = [self._term_postings(term, book_id) for term in terms]
+        if not all(positions for positions, _ in postings):
+            return []
+
+        first_positions, first_offsets = postings[0]
+        last_positions, last_offsets = postings[-1]
+        cursors = [0] * len(terms)
+        spans = []
+
+        for start, offset in zip(first_positions, first_offsets):
+            for i in range(1, len(terms)):
+                positions = postings[i][0]
+                cursors[i] = gallop(positions, start + i, cursors[i])
+                if cursors[i] == len(positions):
+                    # No later occurrence of this word, so no later phrase either
+                    return spans
+                if positions[cursors[i]] != start + i:
+                    break
+            else:
+                spans.append((start, start + len(terms) - 1, offset, last_offsets[cursors[-1]]))
+        return spans
+
+    def _near_spans(self, node, book_id):
+        left = self.spans(node.left, book_id)
+        right = self.spans(node.right, book_id)
+        if not left or not right:
+            return []
+
+        right_starts = [span[0] for span in right]
+        width = max(span[1] - span[0] for span in right)
+        distance = node.distance
+        spans = []
+        index = 0
+
+        for left_span in left:
+            # Earliest right match that could end within the distance before this left match
+            index = gallop(right_starts, left_span[0] - distance - width - 1, index)
+            j = index
+            while j < len(right) and right_starts[j] <= left_span[1] + distance + 1:
+                right_span = right[j]
+                j += 1
+                if right_span[1] < left_span[0]:
+                    gap = left_span[0] - right_span[1] - 1
+                elif right_span[0] > left_span[1]:
+                    gap = right_span[0] - left_span[1] - 1
+                else:
+                    # Overlapping matches (e.g. of the same word) are not near each other
+                    continue
+                if gap <= distance:
+                    spans.append((
+                        min(left_span[0], right_span[0]), max(left_span[1], right_span[1]),
+                        min(left_span[2], right_span[2]), max(left_span[3], right_span[3])
+                    ))
+                    break
+        spans.sort()
+        return spans
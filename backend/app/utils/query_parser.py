@@ -0,0 +1,318 @@
+import re
+from app.utils.tokenizer import TOKEN_PATTERN
+
+# Query tokens: quoted phrases, parentheses, NEAR/n, a '-' negating the phrase or group
+# after it, and words with optional leading '-' (negation) and trailing '*' (prefix)
+QUERY_TOKEN = re.compile(r'"(?P<phrase>[^"]*)"?|(?P<paren>[()])|(?P<minus>-)(?=["(])|(?P<near>NEAR(?:/(?P<distance>\d+))?)(?=[\s()"]|$)|(?P<word>[^\s()"]+)')
+
+# Words allowed between the operands of a NEAR without an explicit distance
+DEFAULT_NEAR_DISTANCE = 10
+
+
+class QueryError(ValueError):
+    """Raised when a search query cannot be parsed."""
+
+
+class Term:
+    """A single word."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f'Term({self.text!r})'
+
+
+class Prefix:
+    """All words starting with a prefix (written ``prefix*``)."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f'Prefix({self.text!r})'
+
+
+class Phrase:
+    """Consecutive words (written in double quotes)."""
+
+    def __init__(self, terms):
+        self.terms = terms
+
+    def __repr__(self):
+        return f'Phrase({self.terms!r})'
+
+
+class Near:
+    """Two words or phrases at most ``distance`` words apart (written ``a NEAR/n b``)."""
+
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def __repr__(self):
+        return f'Near({self.left!r}, {self.right!r}, {self.distance})'
+
+
+class And:
+    """Books matching every positive child and none of the negated ones."""
+
+    def __init__(self, children, excluded=()):
+        self.children = children
+        self.excluded = list(excluded)
+
+    def __repr__(self):
+        return f'And({self.children!r}, excluded={self.excluded!r})'
+
+
+class Or:
+    """Books matching any child."""
+
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f'Or({self.children!r})'
+
+
+class Not:
+    """Negation; only valid as part of an AND."""
+
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f'Not({self.child!r})'
+
+
+def _is_negative(node):
+    """Check whether a node only excludes books, which cannot be evaluated on its own."""
+    return isinstance(node, Not) or (isinstance(node, And) and not node.children)
+
+
+def _words(text):
+    return [match.group().lower() for match in TOKEN_PATTERN.finditer(text)]
+
+
+def _word_node(words):
+    if not words:
+        return None
+    if len(words) == 1:
+        return Term(words[0])
+    return Phrase(words)
+
+
+class QueryParser:
+    """Recursive descent parser for the search query language.
+
+    Supported syntax, from loosest to tightest binding:
+
+    - ``a OR b``
+    - ``a AND b``, or just ``a b``
+    - ``NOT a`` or ``-a`` to exclude books matching ``a``
+    - ``a NEAR/5 b`` for words or phrases at most 5 words apart (``NEAR`` alone allows 10)
+    - ``"exact phrase"``, ``prefix*`` and ``( ... )`` for grouping
+
+    Words are matched case-insensitively with the same tokenizer the index
+    uses, so a word such as ``e-mail`` is treated as the phrase "e mail".
+    """
+
+    def __init__(self, query):
+        self.tokens = self._tokenize(query)
+        self.position = 0
+
+    @staticmethod
+    def _tokenize(query):
+        tokens = []
+        for match in QUERY_TOKEN.finditer(query):
+            if match.group('phrase') is not None:
+                tokens.append(('phrase', match.group('phrase')))
+            elif match.group('paren'):
+                tokens.append((match.group('paren'), None))
+            elif match.group('minus'):
+                tokens.append(('NOT', None))
+            elif match.group('near'):
+                tokens.append(('near', int(match.group('distance') or DEFAULT_NEAR_DISTANCE)))
+            else:
+                word = match.group('word')
+                if word in ('AND', 'OR', 'NOT'):
+                    tokens.append((word, None))
+                elif word.startswith('-') and len(word) > 1:
+                    tokens.append(('NOT', None))
+                    tokens.append(('word', word[1:]))
+                else:
+                    tokens.append(('word', word))
+        return tokens
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def _next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        """Parse the query into a tree of query nodes."""
+        node = self._parse_or()
+        if self._peek() is not None:
+            raise QueryError(f"Unexpected '{self.tokens[self.position][1] or self._peek()}' in query")
+        if node is None:
+            raise QueryError("The query does not contain any searchable words")
+        if _is_negative(node):
+            raise QueryError("A query needs at least one word that is not excluded")
+        return node
+
+    def _parse_or(self):
+        children = [self._parse_and()]
+        while self._peek() == 'OR':
+            self._next()
+            children.append(self._parse_and())
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        if len(children) == 1:
+            return children[0]
+        if any(_is_negative(child) for child in children):
+            raise QueryError("Excluded words cannot be combined with OR")
+        return Or(children)
+
+    def _parse_and(self):
+        children = []
+        excluded = []
+        while self._peek() not in (None, 'OR', ')'):
+            if self._peek() == 'AND':
+                self._next()
+                continue
+            node = self._parse_unary()
+            if node is None:
+                continue
+            if isinstance(node, Not):
+                excluded.append(node.child)
+            elif _is_negative(node):
+                # A group of exclusions, as in 'whale (-python -r)', excludes each of its words
+                excluded.extend(node.excluded)
+            else:
+                children.append(node)
+
+        if not excluded:
+            if not children:
+                return None
+            return children[0] if len(children) == 1 else And(children)
+        if not children:
+            return Not(excluded[0]) if len(excluded) == 1 else And([], excluded)
+        return And(children, excluded)
+
+    def _parse_unary(self):
+        if self._peek() == 'NOT':
+            self._next()
+            child = self._parse_unary()
+            if child is None:
+                raise QueryError("NOT must be followed by a word, phrase or group")
+            if isinstance(child, Not):
+                # NOT NOT x is just x
+                return child.child
+            if _is_negative(child):
+                # Excluding the books without a and without b leaves those with either
+                return Or(child.excluded)
+            return Not(child)
+        return self._parse_near()
+
+    def _parse_near(self):
+        node = self._parse_primary()
+        if self._peek() != 'near':
+            return node
+
+        _, distance = self._next()
+        right = self._parse_primary()
+        for operand in (node, right):
+            if not isinstance(operand, (Term, Phrase, Prefix)):
+                raise QueryError("NEAR can only combine words and phrases")
+        if self._peek() == 'near':
+            raise QueryError("NEAR can only combine two words or phrases")
+        return Near(node, right, distance)
+
+    def _parse_primary(self):
+        kind = self._peek()
+        if kind is None:
+            raise QueryError("The query ends unexpectedly")
+
+        if kind == '(':
+            self._next()
+            node = self._parse_or()
+            if self._peek() != ')':
+                raise QueryError("Missing closing parenthesis")
+            self._next()
+            return node
+        if kind == ')':
+            raise QueryError("Unexpected ')' in query")
+        if kind == 'phrase':
+            return _word_node(_words(self._next()[1]))
+        if kind == 'word':
+            word = self._next()[1]
+            if word.endswith('*'):
+                words = _words(word[:-1])
+                if len(words) != 1:
+                    raise QueryError(f"Invalid prefix '{word}'")
+                return Prefix(words[0])
+            return _word_node(_words(word))
+        raise QueryError(f"Unexpected '{kind}' in query")
+
+
+def parse_query(query):
+    """Parse a search query into a tree of query nodes, raising QueryError if it is invalid."""
+    return QueryParser(query).parse()
+
+
+def canonical_query(node):
+    """Return a normalized string for a query tree.
+
+    Queries that only differ in case, spacing, operator spelling or the
+    order of the operands of AND and OR have the same canonical form, and
+    always give the same results.
+    """
+    if isinstance(node, Term):
+        return _fts5_string(node.text)
+    if isinstance(node, Prefix):
+        return _fts5_string(node.text) + '*'
+    if isinstance(node, Phrase):
+        return _fts5_string(' '.join(node.terms))
+    if isinstance(node, Near):
+        # The order of the operands matters: matches are counted for the left one
+        return f'NEAR/{node.distance}({canonical_query(node.left)} {canonical_query(node.right)})'
+    if isinstance(node, Or):
+        return 'OR(' + ' '.join(sorted({canonical_query(child) for child in node.children})) + ')'
+    if isinstance(node, And):
+        children = ' '.join(sorted(canonical_query(child) for child in node.children))
+        excluded = ' '.join(sorted({canonical_query(child) for child in node.excluded}))
+        return f'AND({children} NOT {excluded})' if excluded else f'AND({children})'
+    raise QueryError(f"Cannot normalize {node!r}")
+
+
+def to_fts5(node):
+    """Translate a query tree into an SQLite FTS5 MATCH expression."""
+    if isinstance(node, Term):
+        return _fts5_string(node.text)
+    if isinstance(node, Prefix):
+        return _fts5_string(node.text) + '*'
+    if isinstance(node, Phrase):
+        return _fts5_string(' '.join(node.terms))
+    if isinstance(node, Near):
+        return f'NEAR({to_fts5(node.left)} {to_fts5(node.right)}, {node.distance})'
+    if isinstance(node, Or):
+        return '(' + ' OR '.join(to_fts5(child) for child in node.children) + ')'
+    if isinstance(node, And):
+        if not node.children:
+            raise QueryError("A query needs at least one word that is not excluded")
+        expression = '(' + ' AND '.join(to_fts5(child) for child in node.children) + ')'
+        for excluded in node.excluded:
+            expression = f'({expression} NOT {to_fts5(excluded)})'
+        return expression
+    raise QueryError(f"Cannot translate {node!r} to FTS5")
+
+
+def _fts5_string(text):
+    return '"' + text.replace('"', '""') + '"'
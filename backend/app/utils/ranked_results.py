@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+
+class RankedResultCache:
+    """Process-wide LRU cache of the ranked result list of recent searches.
+
+    Each entry is the full ranking of one search as a list of
+    [book_id, relevance, spans, snippets] items, where spans are the match
+    offsets used to build snippets and snippets is None until the page
+    holding the result has been requested. Later pages of a search are
+    served from here without running the query again; lists that were
+    evicted are reloaded from the saved search results.
+    """
+
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """Configure the number of cached searches from the application config."""
+        self.max_entries = app.config.get('SEARCH_RESULTS_CACHE_SIZE', self.max_entries)
+
+    def get(self, search_id):
+        """Return the ranked results of a search, or None if they are not cached."""
+        with self._lock:
+            ranked = self._entries.get(search_id)
+            if ranked is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(search_id)
+            self.hits += 1
+            return ranked
+
+    def put(self, search_id, ranked):
+        """Cache the ranked results of a search, evicting the least recently used searches."""
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[search_id] = ranked
+            self._entries.move_to_end(search_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, search_id):
+        """Drop the cached results of a search."""
+        with self._lock:
+            self._entries.pop(search_id, None)
+
+    def clear(self):
+        """Drop all cached results."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return usage counters for the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
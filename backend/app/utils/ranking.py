@@ -0,0 +1,22 @@
+# Okapi BM25 parameters: how quickly repeated words stop adding to the score,
+# and how much longer books are penalized
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def bm25_scores(frequencies, lengths, document_frequencies, document_count, average_length,
+                k1=BM25_K1, b=BM25_B):
+    """Score books against the words of a query with Okapi BM25.
+
+    ``frequencies`` is a NumPy matrix with a row per book and a column per
+    query word holding the number of occurrences, ``lengths`` the length of
+    each book in words and ``document_frequencies`` the number of books of
+    the whole library containing each word. All books are scored in one
+    vectorized operation; returns their scores as an array.
+    """
+    import numpy as np
+
+    idf = np.log1p((document_count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+    normalization = k1 * (1 - b + b * lengths / max(average_length, 1.0))
+    weights = frequencies * (k1 + 1) / (frequencies + normalization[:, np.newaxis])
+    return weights @ idf
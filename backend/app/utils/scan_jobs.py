@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+from app import db
+from app.models.scan_job import ScanJob
+from app.utils.library_scanner import LibraryScanner
+
+logger = logging.getLogger(__name__)
+
+
+class ScanJobRunner:
+    """Runs library scans as background jobs in an in-process worker thread.
+
+    Jobs are persisted in the scan_jobs table so their progress can be polled
+    from any request, and are executed one at a time in submission order.
+    """
+
+    # Minimum number of seconds between progress writes to the database
+    PROGRESS_INTERVAL = 1.0
+
+    def __init__(self):
+        self.app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Bind the runner to the application whose config and database it uses."""
+        self.app = app
+
+    def recover_interrupted(self):
+        """Mark jobs whose worker process is gone as interrupted."""
+        stale_jobs = ScanJob.query.filter(ScanJob.status.in_(ScanJob.ACTIVE_STATUSES)).all()
+        for job in stale_jobs:
+            if job.worker_pid and job.worker_pid != os.getpid() and self._process_alive(job.worker_pid):
+                continue
+            job.status = 'interrupted'
+            job.finished_at = datetime.utcnow()
+            logger.warning(f"Scan job {job.id} was interrupted by a restart")
+        db.session.commit()
+
+    @staticmethod
+    def _process_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def submit(self, user_id, mode='incremental'):
+        """Queue a scan, or return the scan that is already queued or running."""
+        active_job = ScanJob.query.filter(
+            ScanJob.status.in_(ScanJob.ACTIVE_STATUSES)
+        ).order_by(ScanJob.id).first()
+        if active_job:
+            return active_job, False
+
+        job = ScanJob(user_id=user_id, mode=mode, status='queued', worker_pid=os.getpid())
+        db.session.add(job)
+        db.session.commit()
+
+        self._queue.put(job.id)
+        self._ensure_worker()
+        return job, True
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name='scan-job-worker', daemon=True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self._run(job_id)
+            except Exception as e:
+                logger.error(f"Scan job {job_id} crashed: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        """Execute one scan job, recording its progress as it goes."""
+        job = db.session.get(ScanJob, job_id)
+        if job is None or job.status != 'queued':
+            return
+
+        now = datetime.utcnow()
+        job.status = 'running'
+        job.phase = 'scanning'
+        job.started_at = now
+        job.phase_started_at = now
+        db.session.commit()
+
+        last_update = [0.0]
+
+        def progress(phase, discovered, processed, failed):
+            if phase != job.phase:
+                job.phase = phase
+                job.phase_started_at = datetime.utcnow()
+                last_update[0] = 0.0
+
+            if phase == 'indexing':
+                job.books_to_index = discovered
+                job.books_indexed = processed
+            else:
+                job.files_discovered = discovered
+                job.files_processed = processed
+                job.files_failed = failed
+
+            if time.monotonic() - last_update[0] >= self.PROGRESS_INTERVAL:
+                last_update[0] = time.monotonic()
+                db.session.commit()
+
+        config = self.app.config
+        library_path = config['LIBRARY_PATH']
+        os.makedirs(library_path, exist_ok=True)
+
+        scanner = LibraryScanner(
+            library_path,
+            config['SUPPORTED_FORMATS'],
+            workers=config['SCAN_WORKERS'],
+            batch_size=config['SCAN_BATCH_SIZE'],
+            progress=progress
+        )
+
+        try:
+            summary = scanner.scan_library(incremental=job.mode != 'full')
+            job.status = 'completed'
+            job.summary = json.dumps(summary)
+            logger.info(f"Scan job {job.id} completed")
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(ScanJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"Scan job {job.id} failed: {str(e)}")
+
+        job.phase = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+scan_jobs = ScanJobRunner()
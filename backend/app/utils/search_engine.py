@@ -1,134 +1,305 @@
-import re
+import time
+import heapq
 import logging
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
 import concurrent.futures
 import os
-from app.utils.ebook_processor import EbookProcessor, TimeoutError
+from flask import current_app
+from app.utils.ebook_processor import EbookProcessor
+from app.utils.extraction_pool import ExtractionPool, ExtractionError
+from app.utils.fts_index import FtsIndex
+from app.utils.query_executor import DocumentPostings, QueryExecutor
+from app.utils.query_parser import QueryError, canonical_query, parse_query
+from app.utils.snippets import MAX_SNIPPET_SPANS, make_snippets
+from app.utils.text_store import extract_to_store
 from app.models.book import Book
+from app.models.extraction_failure import ExtractionFailure
 from app.models.search import Search, SearchResult
-from app import db
+from app.utils.history_writer import history_writer
+from app import db, query_cache, ranked_results, search_index, text_cache, text_store
 
 logger = logging.getLogger(__name__)
 
-# Set nltk logging to WARNING level
-logging.getLogger('nltk').setLevel(logging.WARNING)
-
-# Download NLTK resources if not already downloaded
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt', quiet=True)
-
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords', quiet=True)
-
 class SearchEngine:
     """Utility class for searching ebooks."""
     
+    # Stored texts longer than this many characters are searched block by block
+    # instead of being loaded (and cached) whole
+    STREAM_THRESHOLD = 1_000_000
+    
     def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
-        # Create a text cache to avoid re-extracting text from the same book
-        self.text_cache = {}
         # Maximum number of books to search in parallel
         self.max_workers = min(os.cpu_count() or 4, 4)  # Limit to avoid resource exhaustion
+        # Search backend: 'index' uses the persistent inverted index, 'fts5' the SQLite
+        # full-text table and 'scan' searches the text of every book
+        self.backend = current_app.config.get('SEARCH_BACKEND', 'index')
+        # Books that were never stored are extracted in a worker process under hard limits
+        self.extraction_pool = ExtractionPool.from_config(current_app.config)
+        self.max_failures = current_app.config.get('EXTRACTION_MAX_FAILURES', 3)
+    
+    def search(self, query, user_id, max_results=50, timeout_ms=None):
+        """Search for books matching the query and save search history.
+        
+        Returns the search and its ranked results as a list of
+        [book_id, relevance, spans, snippets] items. Snippets are only built
+        when a page of results is requested with ``get_results_page``.
+        Rankings are shared through the query cache as tuples; each search
+        gets its own copy of the items.
+        
+        Searches that run longer than ``timeout_ms`` milliseconds stop
+        searching books and rank the results found so far, marking the
+        search as partial. Raises QueryError if the query is invalid.
+        """
+        for event in self.search_stream(query, user_id, max_results, timeout_ms):
+            pass
+        # The last event is ('done', search, ranked)
+        return event[1], event[2]
     
-    def search(self, query, user_id, max_results=50):
-        """Search for books matching the query and save search history."""
-        logger.info(f"Searching for '{query}' for user {user_id}")
+    def search_stream(self, query, user_id, max_results=50, timeout_ms=None):
+        """Search for books matching the query, yielding events as the search progresses.
         
-        # Create search record
-        search = Search(query=query, user_id=user_id)
+        Events are tuples whose first element is their type:
+        
+        - ('start',) once the query is parsed
+        - ('progress', searched, total) as books are searched
+        - ('hit', book, relevance, snippets) for each matching book, in the
+          order they are found
+        - ('done', search, ranked) last, with the ranked results returned by
+          ``search``
+        
+        Books are only searched one by one by the 'scan' backend; the index
+        backends rank all books at once, so they report no hits before the
+        final ranking. Books that are not searched yet are abandoned when
+        ``timeout_ms`` passes or when the generator is closed, e.g. because
+        the client disconnected. Raises QueryError if the query is invalid.
+        """
+        logger.info(f"Searching for '{query}' for user {user_id} using the '{self.backend}' backend")
+        node = parse_query(query)
+        deadline = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+        partial = False
+        yield 'start',
+        
+        # Equivalent queries with the same options share results until the library changes
+        cache_key = (canonical_query(node), self.backend, max_results)
+        generation = search_index.generation()
+        cached = query_cache.get(cache_key, generation)
+        if cached is None:
+            if self.backend == 'index':
+                ranked = self._search_index(node, max_results)
+            elif self.backend == 'fts5':
+                ranked = self._search_fts(node, max_results)
+            else:
+                found = {}
+                books = self._search_all_books(node, max_results, deadline)
+                while True:
+                    try:
+                        event = next(books)
+                    except StopIteration as finished:
+                        ranked, partial = finished.value
+                        break
+                    if event[0] == 'hit':
+                        # Build the snippets of each hit once, for the hit and the final ranking
+                        _, book, relevance, spans = event
+                        found[book.id] = self._make_snippets(book, spans)
+                        event = ('hit', book, relevance, found[book.id])
+                    yield event
+                for item in ranked:
+                    if item[0] in found:
+                        item[2], item[3] = None, found[item[0]]
+            if not partial:
+                query_cache.put(cache_key, generation, [tuple(item) for item in ranked])
+        else:
+            logger.info(f"Using cached results for query '{query}'")
+            # Snippets are filled into the items of a search, so do not share them
+            ranked = [list(item) for item in cached]
+        
+        # Create the search record only now, so that no write transaction is held while searching
+        search = Search(
+            query=query,
+            user_id=user_id,
+            partial=partial,
+            result_count=len(ranked),
+            stored_count=len(history_writer.saved_results(ranked))
+        )
         db.session.add(search)
-        db.session.flush()  # Get search ID without committing
+        db.session.commit()
+        
+        ranked_results.put(search.id, ranked)
+        # The results are saved in the background
+        history_writer.save_results(search.id, ranked)
+        logger.info(f"Found {len(ranked)} results for query '{query}'" + (" before the deadline" if partial else ""))
+        
+        yield 'done', search, ranked
+    
+    def _search_index(self, node, max_results):
+        """Resolve the query through the inverted index."""
+        hits = search_index.search(node, limit=max_results)
+        return [
+            [book.id, relevance, spans[:MAX_SNIPPET_SPANS], None]
+            for book, relevance, spans in self._load_hits(hits)
+        ]
+    
+    def _search_fts(self, node, max_results):
+        """Resolve the query through the FTS5 table, ranked by BM25."""
+        return [
+            [book.id, relevance, None, snippets]
+            for book, relevance, snippets in self._load_hits(FtsIndex.search(node, limit=max_results))
+        ]
+    
+    def _load_hits(self, hits):
+        """Replace the book ids of (book_id, relevance, ...) hits with books, keeping their order."""
+        if not hits:
+            return []
+        
+        books = Book.active().filter(Book.id.in_([hit[0] for hit in hits])).all()
+        books_by_id = {book.id: book for book in books}
+        
+        return [
+            (books_by_id[hit[0]],) + tuple(hit[1:])
+            for hit in hits
+            if hit[0] in books_by_id
+        ]
+    
+    def _make_snippets(self, book, spans):
+        """Build highlighted snippets for a book from the (first word, last word) offsets of its matches."""
+        if not spans:
+            return []
+        
+        try:
+            content_hash = book.content_hash or EbookProcessor.compute_file_hash(book.file_path)
+            if not text_store.has(content_hash):
+                return []
+            with text_store.open(content_hash) as stored:
+                return make_snippets(stored, spans)
+        except Exception as e:
+            logger.error(f"Error reading stored text for {book.title}: {str(e)}")
+            return []
+    
+    def _search_all_books(self, node, max_results, deadline=None):
+        """Search the extracted text of every book in the library.
         
-        # Get all books
-        books = Book.query.all()
+        A generator that yields ('progress', searched, total) and
+        ('hit', book, relevance, spans) events while the books are searched
+        and returns the ranked results and whether the search was cut short
+        by the ``deadline`` (a ``time.monotonic()`` value).
+        """
+        # Get all books, skipping files that failed extraction too often and have not changed since
+        recorded_failures = ExtractionFailure.by_path()
+        books = [
+            book for book in Book.active().all()
+            if not ExtractionFailure.quarantines(recorded_failures, book.file_path)
+        ]
         logger.info(f"Found {len(books)} books to search in")
         
         results = []
+        # Extraction failures from the search threads, recorded here in the request's session
+        failures = []
+        partial = False
+        yield 'progress', 0, len(books)
         
         # Use ThreadPoolExecutor to search books in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
             future_to_book = {
-                executor.submit(self._search_book, book, query): book 
+                executor.submit(self._search_book, book, node, failures): book
                 for book in books
             }
             
-            for future in concurrent.futures.as_completed(future_to_book):
-                book = future_to_book[future]
-                try:
-                    result = future.result()
-                    if result:
-                        relevance, context = result
-                        # Create search result
-                        result = SearchResult(
-                            search_id=search.id,
-                            book_id=book.id,
-                            relevance_score=relevance,
-                            match_context=context
-                        )
-                        
-                        db.session.add(result)
-                        results.append((book, relevance, context))
-                except Exception as e:
-                    logger.error(f"Error searching book {book.title}: {str(e)}")
+            searched = 0
+            timeout = max(0, deadline - time.monotonic()) if deadline is not None else None
+            try:
+                for future in concurrent.futures.as_completed(future_to_book, timeout=timeout):
+                    book = future_to_book[future]
+                    searched += 1
+                    try:
+                        result = future.result()
+                        if result:
+                            results.append((book,) + result)
+                            yield ('hit', book) + result
+                    except QueryError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error searching book {book.title}: {str(e)}")
+                    yield 'progress', searched, len(books)
+            except concurrent.futures.TimeoutError:
+                partial = True
+                logger.info(f"Search deadline passed after searching {searched} of {len(books)} books")
+        finally:
+            # Abandon the books that are not searched yet, when the deadline passed or the
+            # search was closed early; the books being searched finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
         
-        # Sort results by relevance
-        results.sort(key=lambda x: x[1], reverse=True)
-        
-        # Limit results
-        results = results[:max_results]
-        
-        # Commit changes to database
-        try:
-            db.session.commit()
-            logger.info(f"Found {len(results)} results for query '{query}'")
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Error saving search results: {str(e)}")
+        for file_path, error in failures:
+            ExtractionFailure.record(file_path, error, self.max_failures)
         
-        return search, results
+        # Keep the best results without sorting all of them
+        results = heapq.nlargest(max_results, results, key=lambda x: x[1])
+        return [[book.id, relevance, spans, None] for book, relevance, spans in results], partial
     
-    def _search_book(self, book, query):
-        """Search for a query in a book."""
+    def _search_book(self, book, node, failures=None):
+        """Search for a query in a book.
+        
+        Returns (relevance, match spans) when the book matches, else None.
+        Extraction errors are appended to ``failures`` as (file path, error).
+        """
         try:
             # Extract text from book if not already cached
-            if book.id not in self.text_cache:
+            try:
+                cache_key = text_cache.make_key(book.id, book.file_path)
+            except OSError as e:
+                logger.error(f"Cannot access {book.file_path}: {str(e)}")
+                return None
+            
+            text = text_cache.get(cache_key)
+            if text is None:
                 try:
-                    text = EbookProcessor.extract_text_from_file(book.file_path)
-                    # If text is too long, truncate it to avoid memory issues
-                    if len(text) > 1_000_000:  # ~1MB of text
-                        logger.warning(f"Truncating text from {book.title} to avoid memory issues")
-                        text = text[:1_000_000]
-                    self.text_cache[book.id] = text
-                except TimeoutError:
-                    logger.error(f"Timeout extracting text from {book.file_path}")
+                    content_hash = book.content_hash or EbookProcessor.compute_file_hash(book.file_path)
+                    if not text_store.has(content_hash):
+                        # Extract and store books that were never stored
+                        self.extraction_pool.run(extract_to_store, text_store.path, content_hash, book.file_path)
+                    
+                    with text_store.open(content_hash) as stored:
+                        if stored.length > self.STREAM_THRESHOLD:
+                            # Too long to cache, so match it section by section
+                            return self._match_sections(book, node, stored.iter_sections())
+                        text = stored.read()
+                    text_cache.put(cache_key, text)
+                except ExtractionError as e:
+                    logger.error(f"Error extracting text from {book.file_path}: {str(e)}")
+                    if failures is not None:
+                        failures.append((book.file_path, e))
                     return None
+                except QueryError:
+                    raise
                 except Exception as e:
                     logger.error(f"Error extracting text from {book.file_path}: {str(e)}")
                     return None
-            else:
-                text = self.text_cache[book.id]
             
             # If no text was extracted, skip this book
             if not text:
                 return None
-                
-            # Simple search for query in text
-            if self._search_text(query, text):
-                # Calculate relevance score and context
-                relevance, context = self._calculate_relevance(query, text)
-                return relevance, context
             
-            return None
+            return self._match_sections(book, node, text.split(EbookProcessor.SECTION_BREAK))
+        except QueryError:
+            raise
         except Exception as e:
             logger.error(f"Error searching book {book.title}: {str(e)}")
             return None
     
+    @staticmethod
+    def _match_sections(book, node, sections):
+        """Evaluate a query over the sections of one book.
+        
+        Returns (relevance, match spans) or None, where relevance is the
+        number of matches divided by the length of the book in words. Only
+        the spans needed to choose snippets are kept.
+        """
+        postings = DocumentPostings(book.id, sections, node)
+        matches = QueryExecutor(postings).execute(node)
+        if not matches:
+            return None
+        _, count, spans = matches[0]
+        return count / max(1, postings.length), spans[:MAX_SNIPPET_SPANS]
+    
     def get_search_history(self, user_id, limit=10):
         """Get search history for a user."""
         # Fixed query using proper SQLAlchemy model access
@@ -139,55 +310,59 @@ class SearchEngine:
             logger.error(f"Error retrieving search history: {str(e)}")
             return []
     
-    def get_search_results(self, search_id):
-        """Get results for a specific search."""
-        search = Search.query.get(search_id)
-        if not search:
-            return None, []
+    def get_results_page(self, search, offset=0, limit=20):
+        """Return (available, results) for one page of a search's ranked results.
         
-        results = []
-        for result in search.results.order_by(SearchResult.relevance_score.desc()).all():
-            book = Book.query.get(result.book_id)
-            results.append((book, result.relevance_score, result.match_context))
+        Results are (book, relevance, snippets) tuples and available is the
+        number of ranked results that can be paged through. The ranking comes
+        from the cache of recent searches or, failing that, from the saved
+        search results, so the query is not run again; only the best results
+        are saved with SEARCH_HISTORY_TOP_K. Snippets are built for the
+        requested page only and saved with the search results.
+        """
+        ranked = ranked_results.get(search.id)
+        if ranked is None:
+            history_writer.flush()
+            ranked = [
+                [result.book_id, result.relevance_score, None,
+                 result.get_snippets() if result.snippets or result.match_context else None]
+                for result in search.results.order_by(SearchResult.relevance_score.desc(), SearchResult.id).all()
+            ]
+            ranked_results.put(search.id, ranked)
         
-        return search, results
-    
-    def _search_text(self, query, text):
-        """Check if query exists in text."""
-        if not text:
-            return False
+        page = ranked[offset:offset + limit]
+        books = Book.query.filter(Book.id.in_([item[0] for item in page])).all() if page else []
+        books_by_id = {book.id: book for book in books}
         
-        # Simple case-insensitive search
-        return query.lower() in text.lower()
-    
-    def _calculate_relevance(self, query, text, context_size=100):
-        """Calculate relevance score and extract context."""
-        if not text:
-            return 0.0, ""
-        
-        # Convert to lowercase
-        query_lower = query.lower()
-        text_lower = text.lower()
-        
-        # Count occurrences
-        count = text_lower.count(query_lower)
-        
-        # Extract context (text around the first match)
-        match_index = text_lower.find(query_lower)
-        if match_index >= 0:
-            start = max(0, match_index - context_size // 2)
-            end = min(len(text), match_index + len(query) + context_size // 2)
-            context = text[start:end].strip()
-            
-            # Highlight the match
-            match_start = max(0, match_index - start)
-            match_end = match_start + len(query)
-            context = context[:match_start] + "**" + context[match_start:match_end] + "**" + context[match_end:]
-        else:
-            context = ""
-        
-        # Calculate relevance score (simple version)
-        # More sophisticated scoring could be implemented
-        relevance = count / max(1, len(text.split()))
+        missing = [item for item in page if item[3] is None and item[0] in books_by_id]
+        if missing:
+            node = None
+            for item in missing:
+                book = books_by_id[item[0]]
+                spans = item[2]
+                if spans is None:
+                    # The match offsets are gone with the cached ranking, so find them in the stored text
+                    node = node or parse_query(search.query)
+                    spans = self._book_spans(book, node)
+                item[3] = self._make_snippets(book, spans)
+                item[2] = None
+            history_writer.save_snippets(search.id, missing)
         
-        return relevance, context
\ No newline at end of file
+        return len(ranked), [
+            (books_by_id[book_id], relevance, snippets)
+            for book_id, relevance, _, snippets in page
+            if book_id in books_by_id
+        ]
+    
+    def _book_spans(self, book, node):
+        """Find the match spans of a query in the stored text of one book."""
+        try:
+            content_hash = book.content_hash or EbookProcessor.compute_file_hash(book.file_path)
+            if not text_store.has(content_hash):
+                return []
+            with text_store.open(content_hash) as stored:
+                match = self._match_sections(book, node, stored.iter_sections())
+            return match[1] if match else []
+        except Exception as e:
+            logger.error(f"Error reading stored text for {book.title}: {str(e)}")
+            return []
@@ -0,0 +1,123 @@
+import logging
+from app.utils.tokenizer import TOKEN_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Characters of text shown in a snippet
+SNIPPET_SIZE = 160
+# Snippets returned for each book
+MAX_SNIPPETS = 3
+# Matches of a book that are considered when choosing snippets
+MAX_SNIPPET_SPANS = 1000
+# Characters read past the start of the last word of a match to find where the word ends
+WORD_MARGIN = 100
+
+
+def best_passages(spans, count=MAX_SNIPPETS, size=SNIPPET_SIZE, section_at=None):
+    """Choose up to ``count`` non-overlapping passages with the most matches.
+
+    ``spans`` are the (offset of the first word, offset of the last word)
+    of the matches in a book, in order. Every match starts a candidate
+    passage covering the matches whose last word starts within ``size``
+    characters of it (and, given ``section_at``, lie in the same page or
+    chapter); passages are picked greedily by the number of matches they
+    cover. Returns the spans of each chosen passage, best first.
+    """
+    spans = spans[:MAX_SNIPPET_SPANS]
+    sections = [section_at(offset) for offset, _ in spans] if section_at else [0] * len(spans)
+    windows = []
+    end = 0
+    for start, (offset, _) in enumerate(spans):
+        end = max(end, start + 1)
+        while (end < len(spans) and spans[end][1] < offset + size
+                and sections[end] == sections[start]):
+            end += 1
+        windows.append((end - start, start, end))
+
+    # Most matches first, earlier passages first among equals
+    windows.sort(key=lambda window: (-window[0], window[1]))
+
+    chosen = []
+    for _, start, end in windows:
+        if len(chosen) >= count:
+            break
+        if any(start < other_end and other_start < end for other_start, other_end in chosen):
+            continue
+        chosen.append((start, end))
+    return [spans[start:end] for start, end in chosen]
+
+
+def highlight(text, spans, base=0):
+    """Mark (offset, length) spans of text, given relative to ``base``, with **.
+
+    Spans that overlap or touch, such as the words of phrase and NEAR
+    matches, are marked as one.
+    """
+    ranges = []
+    for offset, length in sorted(spans):
+        start = max(0, offset - base)
+        end = min(len(text), offset - base + length)
+        if end <= start:
+            continue
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+
+    parts = []
+    position = 0
+    for start, end in ranges:
+        parts.append(text[position:start])
+        parts.append("**" + text[start:end] + "**")
+        position = end
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def make_snippets(stored, spans, count=MAX_SNIPPETS, size=SNIPPET_SIZE):
+    """Build highlighted snippets for the best passages of a stored text.
+
+    Only the text of the chosen passages is read from the store, using the
+    match offsets recorded at indexing time, so the cost depends on the
+    snippet size rather than the length of the book. Passages stay within
+    the page or chapter of their first match. Returns a list of
+    {'text', 'page', 'label'} dicts, where page is the 1-based page or
+    chapter number and label the chapter id for formats that have one.
+    """
+    snippets = []
+    for passage in best_passages(spans, count, size, stored.section_at):
+        first_offset = passage[0][0]
+        section = stored.section_at(first_offset)
+        section_start, section_end = stored.section_range(section)
+
+        last_offset = max(last for _, last in passage)
+        padding = max(0, size - (last_offset - first_offset)) // 2
+        start = max(section_start, first_offset - padding)
+        text = stored.read_range(start, min(section_end, max(start + size, last_offset + WORD_MARGIN)))
+
+        # Each match ends with its last word as it is written in the text
+        matches = []
+        for offset, last in passage:
+            word = TOKEN_PATTERN.match(text, last - start)
+            matches.append((offset, last - offset + (word.end() - word.start() if word else 0)))
+        covered_end = max(offset + length for offset, length in matches)
+        end = min(section_end, max(start + size, covered_end))
+
+        text = highlight(text[:end - start], matches, start)
+
+        # Do not show words cut off at the edges of the passage, outside the highlights
+        if start > section_start:
+            cut = text.find(' ', 0, max(0, text.find("**")))
+            if cut >= 0:
+                text = text[cut + 1:]
+        if end < section_end:
+            cut = text.rfind(' ', text.rfind("**") + 2)
+            if cut >= 0:
+                text = text[:cut]
+
+        snippets.append({
+            'text': ' '.join(text.split()),
+            'page': section + 1,
+            'label': stored.section_label(section)
+        })
+    return snippets
@@ -0,0 +1,47 @@
+import logging
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_pragmas(config):
+    """Return the PRAGMA statements that tune each SQLite connection, from the application config.
+
+    WAL lets readers carry on while a scan or the history writer holds the
+    write lock, and makes synchronous=NORMAL safe against corruption; the
+    busy timeout makes writers wait for the lock instead of failing.
+    """
+    pragmas = [
+        f"PRAGMA journal_mode = {config.get('SQLITE_JOURNAL_MODE', 'wal')}",
+        f"PRAGMA synchronous = {config.get('SQLITE_SYNCHRONOUS', 'normal')}",
+        f"PRAGMA busy_timeout = {int(config.get('SQLITE_BUSY_TIMEOUT_MS', 30000))}",
+        # A negative cache size is in KiB rather than pages
+        f"PRAGMA cache_size = {-int(config.get('SQLITE_CACHE_SIZE_KB', 65536))}",
+        f"PRAGMA mmap_size = {int(config.get('SQLITE_MMAP_SIZE', 0))}",
+        'PRAGMA temp_store = memory'
+    ]
+    return pragmas
+
+
+def apply_pragmas(conn, pragmas):
+    """Execute PRAGMA statements on a DB-API connection."""
+    cursor = conn.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine, config):
+    """Apply the configured pragmas to every new connection of a SQLite engine."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+    logger.info(f"SQLite connections use: {'; '.join(pragmas)}")
@@ -0,0 +1,104 @@
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TextCache:
+    """Process-wide LRU cache of extracted book text bounded by total size.
+
+    Entries are keyed by book id together with the modification time and size
+    of the book file, so text extracted from an older version of a file is
+    never returned. The cache is shared by all requests and is thread-safe.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._keys_by_book = {}
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        """Configure the cache size from the application config."""
+        self.max_bytes = app.config.get('TEXT_CACHE_MAX_BYTES', self.max_bytes)
+
+    @staticmethod
+    def make_key(book_id, file_path):
+        """Build the cache key for the current version of a book file."""
+        stat = os.stat(file_path)
+        return book_id, stat.st_mtime_ns, stat.st_size
+
+    def get(self, key):
+        """Return the cached text for a key, or None if it is not cached."""
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        """Cache text for a key, evicting least recently used entries as needed."""
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            logger.debug(f"Not caching text for book {key[0]}: {size} bytes exceeds the cache size")
+            return
+
+        with self._lock:
+            # A new version of the book replaces any text cached for an older one
+            old_key = self._keys_by_book.get(key[0])
+            if old_key is not None:
+                self._remove(old_key)
+
+            self._entries[key] = text
+            self._keys_by_book[key[0]] = key
+            self._size += size
+
+            while self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, book_id):
+        """Drop any cached text for a book."""
+        with self._lock:
+            key = self._keys_by_book.get(book_id)
+            if key is not None:
+                self._remove(key)
+
+    def clear(self):
+        """Drop all cached text."""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_book.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        text = self._entries.pop(key)
+        self._size -= sys.getsizeof(text)
+        if self._keys_by_book.get(key[0]) == key:
+            del self._keys_by_book[key[0]]
+
+    def stats(self):
+        """Return usage counters for the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,339 @@
+import os
+import sqlite3
+import logging
+from array import array
+from collections import defaultdict
+from app.utils.query_executor import QueryExecutor
+from app.utils.query_parser import parse_query
+from app.utils.sqlite_tuning import apply_pragmas, sqlite_pragmas
+from app.utils.tokenizer import tokenize_sections
+
+logger = logging.getLogger(__name__)
+
+
+class _IndexPostings:
+    """Postings source for the query executor, read from the index database.
+
+    Book lists come straight from the primary key; frequencies and position
+    blobs are only read for the books the executor asks about.
+    """
+
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def book_ids(self, term):
+        rows = self.conn.execute(
+            'SELECT DISTINCT book_id FROM postings WHERE term = ? ORDER BY book_id', (term,)
+        )
+        return [row[0] for row in rows]
+
+    def positions(self, term, book_id):
+        # Concatenate the segments of the book; positions keep increasing across them
+        positions = array('I')
+        offsets = array('I')
+        rows = self.conn.execute(
+            'SELECT positions, offsets FROM postings WHERE term = ? AND book_id = ? ORDER BY segment',
+            (term, book_id)
+        )
+        for segment_positions, segment_offsets in rows:
+            positions.frombytes(segment_positions)
+            offsets.frombytes(segment_offsets)
+        return positions, offsets
+
+    def frequencies(self, term, book_ids=None):
+        # The frequency column is read without loading the position blobs
+        if book_ids is None:
+            rows = self.conn.execute(
+                'SELECT book_id, SUM(frequency) FROM postings WHERE term = ? GROUP BY book_id', (term,)
+            )
+            return dict(rows)
+
+        # Look up the given books in chunks below SQLite's variable limit
+        frequencies = {}
+        for start in range(0, len(book_ids), self.LOOKUP_CHUNK):
+            chunk = book_ids[start:start + self.LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                'SELECT book_id, SUM(frequency) FROM postings '
+                f'WHERE term = ? AND book_id IN ({", ".join("?" * len(chunk))}) GROUP BY book_id',
+                (term, *chunk)
+            )
+            frequencies.update(rows)
+        return frequencies
+
+    def max_frequency(self, term):
+        row = self.conn.execute('SELECT max_frequency FROM terms WHERE term = ?', (term,)).fetchone()
+        return row[0] if row else 0
+
+    def expand_prefix(self, prefix, limit):
+        # Terms sharing the prefix form one range of the primary key
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self.conn.execute(
+            'SELECT DISTINCT term FROM postings WHERE term >= ? AND term < ? ORDER BY term LIMIT ?',
+            (prefix, upper, limit)
+        )
+        return [row[0] for row in rows]
+
+
+class _DocumentStatistics:
+    """Lengths of the indexed books, kept in memory as sorted NumPy arrays for ranking.
+
+    Loaded once per library generation. Books indexed since then, while a
+    scan is still running, are ranked as if they had the average length.
+    """
+
+    def __init__(self, conn, generation):
+        import numpy as np
+
+        rows = conn.execute('SELECT book_id, length FROM documents ORDER BY book_id').fetchall()
+        self.generation = generation
+        self.book_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.book_lengths = np.array([row[1] for row in rows], dtype=np.float64)
+        self.document_count = len(rows)
+        self.average_length = float(self.book_lengths.mean()) if rows else 0.0
+
+    def lengths(self, book_ids):
+        """Return the lengths of a sorted array of book ids."""
+        import numpy as np
+
+        rows = np.searchsorted(self.book_ids, book_ids)
+        found = rows < len(self.book_ids)
+        found[found] = self.book_ids[rows[found]] == book_ids[found]
+        lengths = np.full(len(book_ids), self.average_length)
+        lengths[found] = self.book_lengths[rows[found]]
+        return lengths
+
+
+class InvertedIndex:
+    """Persistent on-disk inverted index mapping terms to book postings.
+
+    Each posting stores the token positions of a term within a book together
+    with the character offsets of those tokens, so phrase queries can be
+    resolved from the index alone and match context can be read from the
+    text store without re-extracting the ebook.
+
+    Books are indexed section by section and their postings are flushed in
+    segments of at most SEGMENT_TOKENS tokens, so indexing memory does not
+    grow with the size of the book. A term has one posting row per segment
+    of a book that contains it.
+
+    The terms table keeps the highest frequency of each term in any book, the
+    upper bound used to skip books that cannot rank in the top results. It is
+    raised as books are indexed and not lowered when they are removed, so it
+    stays an upper bound, if a looser one, until the index is rebuilt.
+    """
+
+    SCHEMA_VERSION = 4
+    SEGMENT_TOKENS = 200_000
+
+    def __init__(self, path=None):
+        self.path = path
+        self.pragmas = []
+        self._statistics = None
+        if path:
+            self._ensure_schema()
+
+    def init_app(self, app):
+        """Bind the index to the application's configured index file."""
+        self.path = app.config.get('SEARCH_INDEX_PATH') or os.path.join(app.instance_path, 'search_index.db')
+        self.pragmas = sqlite_pragmas(app.config)
+        self._ensure_schema()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        apply_pragmas(conn, self.pragmas)
+        return conn
+
+    def _ensure_schema(self):
+        """Create the index tables, rebuilding them if the schema changed."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+                row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+                if row and int(row[0]) != self.SCHEMA_VERSION:
+                    logger.warning(f"Search index schema changed, discarding index at {self.path}; rescan the library to rebuild it")
+                    conn.execute('DROP TABLE IF EXISTS postings')
+                    conn.execute('DROP TABLE IF EXISTS documents')
+                    conn.execute('DROP TABLE IF EXISTS terms')
+
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS documents ('
+                    'book_id INTEGER PRIMARY KEY, '
+                    'length INTEGER NOT NULL)'
+                )
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS postings ('
+                    'term TEXT NOT NULL, '
+                    'book_id INTEGER NOT NULL, '
+                    'segment INTEGER NOT NULL, '
+                    'frequency INTEGER NOT NULL, '
+                    'positions BLOB NOT NULL, '
+                    'offsets BLOB NOT NULL, '
+                    'PRIMARY KEY (term, book_id, segment)) WITHOUT ROWID'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS ix_postings_book_id ON postings (book_id)')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS terms ('
+                    'term TEXT PRIMARY KEY, '
+                    'max_frequency INTEGER NOT NULL) WITHOUT ROWID'
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                    (str(self.SCHEMA_VERSION),)
+                )
+        finally:
+            conn.close()
+
+    def generation(self):
+        """Return the library generation, which changes whenever books are added, changed or removed."""
+        conn = self._connect()
+        try:
+            return self._read_generation(conn)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _read_generation(conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bump_generation(self):
+        """Record that the library changed, invalidating cached search results in every process."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('generation', 1) "
+                    "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+                )
+        finally:
+            conn.close()
+
+    def has_document(self, book_id):
+        """Check whether a book has been indexed."""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT 1 FROM documents WHERE book_id = ?', (book_id,)).fetchone()
+            return row is not None
+        finally:
+            conn.close()
+
+    def document_ids(self):
+        """Return the ids of all indexed books."""
+        conn = self._connect()
+        try:
+            return {row[0] for row in conn.execute('SELECT book_id FROM documents')}
+        finally:
+            conn.close()
+
+    def add_document(self, book_id, sections):
+        """Index the text of a book, replacing any previous postings for it.
+
+        The text is given as an iterable of sections (pages or chapters), which
+        are consumed one at a time. Character offsets count the section breaks
+        between sections, matching the offsets of the text store.
+        """
+        if isinstance(sections, str):
+            sections = [sections]
+
+        postings = defaultdict(lambda: (array('I'), array('I')))
+        frequencies = defaultdict(int)
+        length = 0
+        segment = 0
+        segment_start = 0
+        term_count = 0
+
+        def flush():
+            for term, (positions, _) in postings.items():
+                frequencies[term] += len(positions)
+            rows = (
+                (term, book_id, segment, len(positions), positions.tobytes(), offsets.tobytes())
+                for term, (positions, offsets) in postings.items()
+            )
+            conn.executemany(
+                'INSERT INTO postings (term, book_id, segment, frequency, positions, offsets) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM postings WHERE book_id = ?', (book_id,))
+
+                for position, offset, term in tokenize_sections(sections):
+                    if position - segment_start >= self.SEGMENT_TOKENS:
+                        term_count += len(postings)
+                        flush()
+                        postings.clear()
+                        segment += 1
+                        segment_start = position
+
+                    positions, offsets = postings[term]
+                    positions.append(position)
+                    offsets.append(offset)
+                    length = position + 1
+
+                term_count += len(postings)
+                flush()
+                conn.executemany(
+                    'INSERT INTO terms (term, max_frequency) VALUES (?, ?) '
+                    'ON CONFLICT (term) DO UPDATE SET max_frequency = MAX(max_frequency, excluded.max_frequency)',
+                    frequencies.items()
+                )
+                conn.execute(
+                    'INSERT OR REPLACE INTO documents (book_id, length) VALUES (?, ?)',
+                    (book_id, length)
+                )
+        finally:
+            conn.close()
+
+        logger.debug(f"Indexed {length} tokens ({term_count} postings in {segment + 1} segments) for book {book_id}")
+
+    def remove_document(self, book_id):
+        """Remove a book from the index."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM postings WHERE book_id = ?', (book_id,))
+                conn.execute('DELETE FROM documents WHERE book_id = ?', (book_id,))
+        finally:
+            conn.close()
+
+    def search(self, query, limit=50):
+        """Find books matching a query.
+
+        The query is a query string or a tree from ``parse_query``. Returns up
+        to ``limit`` tuples of (book_id, relevance, matches) sorted by
+        relevance, where relevance is the BM25 score of the book and matches
+        are the (offset of the first word, offset of the last word) of every
+        match. Raises QueryError
+        for an invalid query.
+
+        Candidates are ranked by an upper bound of their score, from the
+        highest frequency of each term and the book lengths. Frequencies are
+        only read for the candidates whose bound can still make the top, and
+        positions for the best of them, until ``limit`` are found to match.
+        """
+        if isinstance(query, str):
+            query = parse_query(query)
+
+        conn = self._connect()
+        try:
+            executor = QueryExecutor(_IndexPostings(conn))
+            return executor.top_k(query, limit, self._document_statistics(conn))
+        finally:
+            conn.close()
+
+    def _document_statistics(self, conn):
+        """Return the book lengths, reloading them when the library generation changed."""
+        generation = self._read_generation(conn)
+        statistics = self._statistics
+        if statistics is None or statistics.generation != generation:
+            statistics = _DocumentStatistics(conn, generation)
+            self._statistics = statistics
+        return statistics
@@ -0,0 +1,261 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from app.utils.ebook_processor import EbookProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def extract_to_store(text_store_path, content_hash, file_path):
+    """Extract an ebook into the text store at the given path.
+
+    Module-level so it can run in an extraction worker process.
+    """
+    return TextStore(text_store_path).ensure(content_hash, file_path)
+
+
+class StoredText:
+    """Read access to one memory-mapped text file in the store.
+
+    The file is a sequence of independently zlib-compressed blocks followed by
+    a JSON block table, so any character range can be read by decompressing
+    only the blocks that cover it.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        if self._map[:len(TextStore.MAGIC)] != TextStore.MAGIC:
+            self.close()
+            raise ValueError(f"Not a text store file: {path}")
+
+        table_offset, = struct.unpack('<Q', self._map[-8:])
+        table = json.loads(self._map[table_offset:-8].decode('utf-8'))
+        # Each block is [file offset, compressed length, first character, section number]
+        self.blocks = table['blocks']
+        self.length = table['length']
+        self.sections = table['sections']
+        # Optional per-section labels, such as EPUB chapter ids
+        self.labels = table.get('labels')
+        self._block_starts = [block[2] for block in self.blocks]
+        self._block_sections = [block[3] for block in self.blocks]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _block_text(self, index):
+        offset, compressed_length = self.blocks[index][:2]
+        return zlib.decompress(self._map[offset:offset + compressed_length]).decode('utf-8')
+
+    def iter_blocks(self):
+        """Yield (first character, text) for each block in order."""
+        for index, block in enumerate(self.blocks):
+            yield block[2], self._block_text(index)
+
+    def iter_sections(self):
+        """Yield the text of each section (page or chapter) in order."""
+        current = 0
+        parts = []
+        for index, block in enumerate(self.blocks):
+            while block[3] > current:
+                yield ''.join(parts)
+                parts = []
+                current += 1
+            
+            text = self._block_text(index)
+            if current and not parts:
+                # Drop the section break the writer put in front of the section
+                text = text[len(EbookProcessor.SECTION_BREAK):]
+            parts.append(text)
+        
+        if self.sections:
+            yield ''.join(parts)
+        for _ in range(current + 1, self.sections):
+            yield ""
+    
+    def read(self):
+        """Return the whole text."""
+        return ''.join(self._block_text(index) for index in range(len(self.blocks)))
+
+    def read_range(self, start, end):
+        """Return the text between two character offsets."""
+        start = max(0, start)
+        end = min(self.length, end)
+        if start >= end:
+            return ""
+
+        first = max(0, bisect_right(self._block_starts, start) - 1)
+        last = max(0, bisect_right(self._block_starts, end - 1) - 1)
+        text = ''.join(self._block_text(index) for index in range(first, last + 1))
+        base = self._block_starts[first]
+        return text[start - base:end - base]
+
+    def section_at(self, offset):
+        """Return the section (page or chapter) number containing an offset."""
+        if not self.blocks:
+            return 0
+        # Blocks never span sections, so the block table alone answers this
+        index = max(0, bisect_right(self._block_starts, offset) - 1)
+        return self.blocks[index][3]
+
+    def section_range(self, section):
+        """Return the (start, end) character offsets of a section, excluding its section break."""
+        first = bisect_left(self._block_sections, section)
+        last = bisect_left(self._block_sections, section + 1)
+        if first == last:
+            # Empty sections have no blocks
+            start = self._block_starts[first] if first < len(self.blocks) else self.length
+            return start, start
+        start = self._block_starts[first] + (len(EbookProcessor.SECTION_BREAK) if section else 0)
+        end = self._block_starts[last] if last < len(self.blocks) else self.length
+        return start, end
+
+    def section_label(self, section):
+        """Return the label of a section, or None if the format does not label sections."""
+        if not self.labels or not 0 <= section < len(self.labels):
+            return None
+        return self.labels[section]
+
+
+class TextStore:
+    """On-disk store of compressed extracted text, keyed by ebook content hash.
+
+    Text is written once per distinct ebook file and read back through
+    memory-mapped files, so restarts and other worker processes reuse it
+    without parsing the ebook again and without keeping it in memory.
+    """
+
+    MAGIC = b'EBTXT\x00\x01\x00'
+    BLOCK_CHARS = 64 * 1024
+    FILE_EXTENSION = '.txtz'
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def init_app(self, app):
+        """Bind the store to the application's configured directory."""
+        self.path = app.config.get('TEXT_STORE_PATH') or os.path.join(app.instance_path, 'text_store')
+        os.makedirs(self.path, exist_ok=True)
+
+    def path_for(self, content_hash):
+        """Return the file path that holds the text for a content hash."""
+        return os.path.join(self.path, content_hash[:2], content_hash + self.FILE_EXTENSION)
+
+    def has(self, content_hash):
+        """Check whether text for a content hash has been stored."""
+        return bool(content_hash) and os.path.exists(self.path_for(content_hash))
+
+    def open(self, content_hash):
+        """Open the stored text for a content hash."""
+        return StoredText(self.path_for(content_hash))
+
+    def read(self, content_hash):
+        """Return the stored text for a content hash, or None if it is missing."""
+        if not self.has(content_hash):
+            return None
+        try:
+            with self.open(content_hash) as stored:
+                return stored.read()
+        except Exception as e:
+            logger.error(f"Error reading stored text {content_hash}: {str(e)}")
+            return None
+
+    def read_range(self, content_hash, start, end):
+        """Return part of the stored text for a content hash."""
+        if not self.has(content_hash):
+            return None
+        with self.open(content_hash) as stored:
+            return stored.read_range(start, end)
+
+    def ensure(self, content_hash, file_path):
+        """Extract and store the text of an ebook unless it is already stored.
+        
+        The ebook is streamed into the store one section at a time, so even
+        very large books are extracted with bounded memory.
+        """
+        if self.has(content_hash):
+            return False
+        self.write(content_hash, EbookProcessor.iter_labeled_sections(file_path))
+        return True
+    
+    def write(self, content_hash, sections):
+        """Store text given as an iterable of sections (pages or chapters).
+
+        Sections are strings or (label, text) tuples; labels are kept in the
+        block table and can be looked up with StoredText.section_label.
+
+        Sections are consumed one at a time and compressed into blocks as they
+        arrive, so arbitrarily long texts are written with bounded memory.
+        Returns the number of characters written.
+        """
+        path = self.path_for(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+        blocks = []
+        labels = []
+        length = 0
+        section_count = 0
+
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(self.MAGIC)
+                offset = len(self.MAGIC)
+
+                for section_number, section in enumerate(sections):
+                    if isinstance(section, tuple):
+                        label, section = section
+                        labels.append(label)
+                    else:
+                        labels.append(None)
+                    if section_number:
+                        section = EbookProcessor.SECTION_BREAK + section
+                    section_count = section_number + 1
+
+                    for i in range(0, max(1, len(section)), self.BLOCK_CHARS):
+                        block_text = section[i:i + self.BLOCK_CHARS]
+                        if not block_text:
+                            continue
+                        compressed = zlib.compress(block_text.encode('utf-8'))
+                        file.write(compressed)
+                        blocks.append([offset, len(compressed), length, section_number])
+                        offset += len(compressed)
+                        length += len(block_text)
+
+                table = {'blocks': blocks, 'length': length, 'sections': section_count}
+                if any(label is not None for label in labels):
+                    table['labels'] = labels
+                table = json.dumps(table)
+                file.write(table.encode('utf-8'))
+                file.write(struct.pack('<Q', offset))
+
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        logger.debug(f"Stored {length} characters in {len(blocks)} blocks for {content_hash}")
+        return length
+
+    def remove(self, content_hash):
+        """Delete the stored text for a content hash."""
+        if self.has(content_hash):
+            os.remove(self.path_for(content_hash))
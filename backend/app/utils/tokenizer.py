@@ -0,0 +1,28 @@
+import re
+from app.utils.ebook_processor import EbookProcessor
+
+# Words are maximal runs of unicode word characters, compared case-insensitively
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Yield (position, offset, term) for every word in the text."""
+    for position, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        yield position, match.start(), match.group().lower()
+
+
+def tokenize_sections(sections):
+    """Yield (position, offset, term) for every word in a sequence of sections.
+
+    Positions run on across sections and offsets count a section break
+    between consecutive sections, matching the offsets of the text store.
+    """
+    position = 0
+    base_offset = 0
+    for number, section in enumerate(sections):
+        if number:
+            base_offset += len(EbookProcessor.SECTION_BREAK)
+        for match in TOKEN_PATTERN.finditer(section or ""):
+            yield position, base_offset + match.start(), match.group().lower()
+            position += 1
+        base_offset += len(section or "")
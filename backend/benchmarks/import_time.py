@@ -0,0 +1,82 @@
+"""Measure how long a worker process takes to import the application.
+
+Runs a fresh interpreter with ``python -X importtime`` several times, reports
+the slowest modules of the fastest run and fails when:
+
+- a module that should only be loaded on first use (NLTK, the PDF libraries,
+  NumPy) is imported at startup, or
+- the application takes longer than ``--budget-ms`` to import.
+
+Run from the backend directory:
+
+    python benchmarks/import_time.py --runs 5 --budget-ms 1500
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What a web or scan worker imports when it boots
+STARTUP_IMPORTS = (
+    'from app import create_app; '
+    'import app.routes.auth, app.routes.books, app.routes.search; '
+    'import app.utils.search_engine, app.utils.library_scanner, app.utils.scan_jobs'
+)
+
+# Packages that must be imported lazily, on first use
+LAZY_PACKAGES = ('nltk', 'PyPDF2', 'pdfminer', 'numpy')
+
+
+def measure():
+    """Return {module: (self us, cumulative us)} for one cold import, with nested modules indented."""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_IMPORTS],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented below the module that imported them
+        modules[name[1:].rstrip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold imports to measure; the fastest counts')
+    parser.add_argument('--budget-ms', type=float, default=0, help='fail above this import time, 0 for no budget')
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    # Nested imports are included in their parent's cumulative time, so add up the top-level ones
+    totals = [
+        sum(cumulative for name, (_, cumulative) in modules.items() if name == name.lstrip())
+        for modules in runs
+    ]
+    fastest = runs[totals.index(min(totals))]
+    total_ms = min(totals) / 1000
+
+    print(f"Application import: {total_ms:.0f} ms (fastest of {args.runs}, slowest {max(totals) / 1000:.0f} ms)")
+    slowest = sorted(((self_us, name.strip()) for name, (self_us, _) in fastest.items()), reverse=True)
+    print("Slowest modules by their own import time:")
+    for self_us, name in slowest[:args.top]:
+        print(f"{self_us / 1000:>10.1f} ms  {name}")
+
+    failed = False
+    eager = sorted({name.strip() for name in fastest if name.strip().split('.')[0] in LAZY_PACKAGES})
+    if eager:
+        print(f"FAIL: imported at startup instead of on first use: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms and total_ms > args.budget_ms:
+        print(f"FAIL: import took {total_ms:.0f} ms, over the budget of {args.budget_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Measure concurrent read/write throughput of SQLite with and without the connection tuning.
+
+Reader threads look up search results while a writer thread inserts them
+in batches, the way searches read history while the history writer and
+library scans write. Each profile runs against a fresh database file:
+
+- default: SQLite's rollback journal with synchronous=FULL, as the app used before
+- tuned: the pragmas and pool from config.Config (WAL, synchronous=NORMAL, ...)
+
+Run from the backend directory:
+
+    python benchmarks/sqlite_concurrency.py --seconds 10 --readers 4
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Float, Integer, MetaData, Table, Text, create_engine, select
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from app.utils.sqlite_tuning import configure_engine
+
+metadata = MetaData()
+results = Table(
+    'search_results', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('search_id', Integer, nullable=False, index=True),
+    Column('book_id', Integer, nullable=False),
+    Column('relevance_score', Float),
+    Column('match_context', Text)
+)
+
+
+def make_engine(path, profile):
+    if profile == 'default':
+        return create_engine(f'sqlite:///{path}')
+
+    engine = create_engine(f'sqlite:///{path}', **Config.SQLALCHEMY_ENGINE_OPTIONS)
+    settings = {name: getattr(Config, name) for name in dir(Config) if name.startswith('SQLITE_')}
+    configure_engine(engine, settings)
+    return engine
+
+
+def rows(search_id, count):
+    return [
+        {
+            'search_id': search_id,
+            'book_id': random.randint(1, 50_000),
+            'relevance_score': random.random(),
+            'match_context': 'It was a dark and stormy night ' * 4
+        }
+        for _ in range(count)
+    ]
+
+
+def run(profile, seconds, readers, batch_size, searches):
+    directory = tempfile.mkdtemp()
+    engine = make_engine(os.path.join(directory, 'benchmark.db'), profile)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for search_id in range(1, searches + 1):
+            conn.execute(results.insert(), rows(search_id, 20))
+
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def read():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(
+                        select(results).where(results.c.search_id == random.randint(1, searches))
+                    ).fetchall()
+            except OperationalError:
+                with lock:
+                    counts['errors'] += 1
+                continue
+            with lock:
+                counts['reads'] += 1
+                latencies.append(time.perf_counter() - started)
+
+    def write():
+        search_id = searches
+        while not stop.is_set():
+            search_id += 1
+            try:
+                with engine.begin() as conn:
+                    conn.execute(results.insert(), rows(search_id, batch_size))
+            except OperationalError:
+                with lock:
+                    counts['errors'] += 1
+                continue
+            with lock:
+                counts['writes'] += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float('nan')
+    return {
+        'profile': profile,
+        'reads/s': counts['reads'] / seconds,
+        'writes/s': counts['writes'] / seconds,
+        'rows/s': counts['writes'] * batch_size / seconds,
+        'p95 read ms': p95,
+        'errors': counts['errors']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5, help='duration of each run')
+    parser.add_argument('--readers', type=int, default=4, help='reader threads')
+    parser.add_argument('--batch-size', type=int, default=50, help='rows inserted per write transaction')
+    parser.add_argument('--searches', type=int, default=1000, help='searches in the database before the run')
+    args = parser.parse_args()
+
+    reports = [
+        run(profile, args.seconds, args.readers, args.batch_size, args.searches)
+        for profile in ('default', 'tuned')
+    ]
+    columns = list(reports[0])
+    print(' '.join(f'{column:>12}' for column in columns))
+    for report in reports:
+        print(' '.join(
+            f'{value:>12.1f}' if isinstance(value, float) else f'{value:>12}'
+            for value in report.values()
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,18 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI', 'sqlite:///ebook_search.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 10)),  # Connections kept open for request and worker threads
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),  # Extra connections opened under load
+        'pool_timeout': 30
+    }
+    
+    # SQLite tuning, applied to every connection of the database and of the search index
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')  # 'wal' lets searches read while books or history are written
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')  # 'normal' only syncs at WAL checkpoints, 'full' on every commit
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 30000))  # How long a writer waits for the lock
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))  # Page cache per connection
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # Bytes of the database file read through mmap, 0 to disable
     
     # JWT
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key')
@@ -21,7 +33,39 @@ class Config:
     LIBRARY_PATH = os.environ.get('LIBRARY_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'library'))
     
     # File types
-    SUPPORTED_FORMATS = ['pdf', 'epub', 'azw3']
+    SUPPORTED_FORMATS = ['pdf', 'epub', 'azw3', 'azw', 'mobi']
+    
+    # Scanning
+    SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', os.cpu_count() or 1))  # Processes extracting new books in parallel
+    SCAN_BATCH_SIZE = int(os.environ.get('SCAN_BATCH_SIZE', 200))  # Books written per database commit
+    
+    # Extraction workers (text is extracted in separate processes under hard limits)
+    EXTRACTION_TIMEOUT = float(os.environ.get('EXTRACTION_TIMEOUT', 300))  # Seconds per file before the worker is killed
+    EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get('EXTRACTION_MEMORY_LIMIT_MB', 1024))  # Memory a worker may allocate, 0 for no limit
+    EXTRACTION_MAX_TASKS_PER_WORKER = int(os.environ.get('EXTRACTION_MAX_TASKS_PER_WORKER', 50))  # Files per worker before it is replaced
+    EXTRACTION_MAX_FAILURES = int(os.environ.get('EXTRACTION_MAX_FAILURES', 3))  # Failed attempts before a file is quarantined
+    
+    # Library watcher (applies file changes without a full scan)
+    WATCH_LIBRARY = os.environ.get('WATCH_LIBRARY', 'false').lower() in ('1', 'true', 'yes')
+    WATCH_DEBOUNCE_SECONDS = float(os.environ.get('WATCH_DEBOUNCE_SECONDS', 2.0))  # Quiet time before applying changes
+    WATCH_POLL_INTERVAL = float(os.environ.get('WATCH_POLL_INTERVAL', 30.0))  # Seconds between polls without inotify
+    WATCH_FORCE_POLLING = os.environ.get('WATCH_FORCE_POLLING', 'false').lower() in ('1', 'true', 'yes')
+    
+    # Search
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'index')  # 'index' (inverted index), 'fts5' (SQLite FTS5) or 'scan' (brute force)
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH')  # Defaults to search_index.db in the instance folder
+    TEXT_STORE_PATH = os.environ.get('TEXT_STORE_PATH')  # Defaults to text_store/ in the instance folder
+    TEXT_CACHE_MAX_BYTES = int(os.environ.get('TEXT_CACHE_MAX_BYTES', 256 * 1024 * 1024))  # Extracted text kept in memory
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))  # Results per page unless a request asks for more
+    SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100))  # Largest page a request may ask for
+    SEARCH_RESULTS_CACHE_SIZE = int(os.environ.get('SEARCH_RESULTS_CACHE_SIZE', 100))  # Recent searches whose ranking is kept for paging
+    SEARCH_QUERY_CACHE_SIZE = int(os.environ.get('SEARCH_QUERY_CACHE_SIZE', 256))  # Distinct queries whose results are shared between users
+    SEARCH_QUERY_CACHE_TTL = float(os.environ.get('SEARCH_QUERY_CACHE_TTL', 300))  # Seconds a cached query result stays valid, 0 to disable
+    SEARCH_TIMEOUT_MS = int(os.environ.get('SEARCH_TIMEOUT_MS', 0))  # Default search deadline in milliseconds, 0 for none
+    SEARCH_HISTORY_ASYNC = os.environ.get('SEARCH_HISTORY_ASYNC', 'true').lower() in ('1', 'true', 'yes')  # Save search results in a background thread
+    SEARCH_HISTORY_TOP_K = int(os.environ.get('SEARCH_HISTORY_TOP_K', 0))  # Only save the ids and scores of this many results per search, 0 for all
+    BOOKS_PAGE_SIZE = int(os.environ.get('BOOKS_PAGE_SIZE', 100))  # Books per listing page unless a request asks for more
+    BOOKS_MAX_PAGE_SIZE = int(os.environ.get('BOOKS_MAX_PAGE_SIZE', 1000))  # Largest page of books a listing request may ask for
 
 
 class DevelopmentConfig(Config):
@@ -35,6 +79,8 @@ class TestingConfig(Config):
     DEBUG = False
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}  # An in-memory database lives in a single connection
+    SEARCH_HISTORY_ASYNC = False  # Save search results during the request, on that connection
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import create_app, db, query_cache, ranked_results, text_cache
+from app.models.user import User
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An application on TestingConfig whose index and text store live in a temporary folder."""
+    app = create_app('testing', {
+        'SEARCH_INDEX_PATH': str(tmp_path / 'search_index.db'),
+        'TEXT_STORE_PATH': str(tmp_path / 'text_store'),
+        'LIBRARY_PATH': str(tmp_path / 'library')
+    })
+    # The caches are shared by the process, while ids start again in every test database
+    ranked_results.clear()
+    query_cache.clear()
+    text_cache.clear()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_id(app):
+    with app.app_context():
+        user = User(username='reader', email='reader@example.com')
+        user.password = 'secret'
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def auth_headers(app, user_id):
+    with app.app_context():
+        token = create_access_token(identity=str(user_id))
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def count_statements(app):
+    """Return a context manager collecting the SQL statements executed on the database."""
+    @contextmanager
+    def counting():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    return counting
@@ -0,0 +1,40 @@
+import pytest
+
+from app import db
+from app.models.book import Book
+from app.routes.books import starts_with
+
+TITLES = ['Moby Dick', 'moby_dick', 'Mobile 100%', 'Mobile 1000', 'Emma']
+
+
+@pytest.fixture
+def books(app):
+    with app.app_context():
+        db.session.add_all(
+            Book(title=title, author=f'Author of {title}', file_path=f'/library/{number}.epub', file_format='epub')
+            for number, title in enumerate(TITLES)
+        )
+        db.session.commit()
+
+
+@pytest.mark.parametrize('prefix, expected', [
+    ('MOB', ['Mobile 100%', 'Mobile 1000', 'Moby Dick', 'moby_dick']),
+    ('moby_', ['moby_dick']),
+    ('mobile 100%', ['Mobile 100%']),
+    ('x', []),
+])
+def test_books_are_filtered_by_title_prefix(client, auth_headers, books, prefix, expected):
+    response = client.get('/api/books/', query_string={'title_prefix': prefix, 'sort': 'title'},
+                          headers=auth_headers)
+    assert response.status_code == 200
+    assert sorted(book['title'] for book in response.get_json()['books']) == expected
+
+
+@pytest.mark.parametrize('column', ['title', 'author'])
+def test_prefix_filters_search_an_index(app, column):
+    with app.app_context():
+        query = Book.active().filter(starts_with(getattr(Book, column), 'mob'))
+        compiled = query.statement.compile(db.engine)
+        parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+        plan = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', parameters).fetchall()
+    assert any(f'{column}>? AND {column}<?' in row[-1] for row in plan)
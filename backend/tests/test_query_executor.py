@@ -0,0 +1,98 @@
+import pytest
+
+from app.utils.query_executor import DocumentPostings, QueryExecutor, gallop, intersect, union
+from app.utils.query_parser import And, QueryError, Term, parse_query
+from app.utils.text_index import InvertedIndex
+
+BOOKS = {
+    1: 'The whale swam past the ship',
+    2: 'A python script about the whale',
+    3: 'Whale songs in R and python',
+    4: 'The ship sailed on',
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = InvertedIndex(str(tmp_path / 'search_index.db'))
+    for book_id, text in BOOKS.items():
+        index.add_document(book_id, [text])
+    return index
+
+
+def matching(index, query):
+    return sorted(book_id for book_id, _, _ in index.search(query, limit=len(BOOKS)))
+
+
+def test_gallop_finds_the_first_value_at_least_the_target():
+    values = [1, 3, 5, 7, 9, 11, 13]
+    assert gallop(values, 6) == 3
+    assert gallop(values, 7) == 3
+    assert gallop(values, 1, low=2) == 2
+    assert gallop(values, 14) == len(values)
+
+
+def test_intersect_and_union_of_sorted_lists():
+    assert intersect([1, 3, 5, 7, 9], [2, 3, 4, 9, 10]) == [3, 9]
+    assert intersect([9], list(range(0, 1000, 3))) == [9]
+    assert intersect([], [1, 2]) == []
+    assert union([[1, 4], [2, 4, 6], []]) == [1, 2, 4, 6]
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('whale ship', [1]),
+    ('whale OR ship', [1, 2, 3, 4]),
+    ('python whale', [2, 3]),
+    ('ship -whale', [4]),
+    ('(ship OR python) whale', [1, 2, 3]),
+    ('wha*', [1, 2, 3]),
+])
+def test_boolean_queries_intersect_and_merge_book_lists(index, query, expected):
+    assert matching(index, query) == expected
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('"the whale"', [1, 2]),
+    ('"whale swam"', [1]),
+    ('"swam whale"', []),
+    ('"python script about"', [2]),
+])
+def test_phrases_match_consecutive_words(index, query, expected):
+    assert matching(index, query) == expected
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('whale NEAR/1 past', [1]),
+    ('past NEAR/1 whale', [1]),
+    ('whale NEAR/0 past', []),
+    ('whale NEAR/2 ship', []),
+    ('whale NEAR/3 ship', [1]),
+    ('"whale swam" NEAR/0 past', [1]),
+    ('whale NEAR python', [2, 3]),
+])
+def test_near_matches_words_within_the_distance(index, query, expected):
+    assert matching(index, query) == expected
+
+
+def test_matches_run_from_the_first_to_the_last_word():
+    text = BOOKS[1]
+    node = parse_query('"whale swam" OR whale NEAR/1 past')
+    (book_id, count, spans), = QueryExecutor(DocumentPostings(1, [text], node)).execute(node)
+    assert (book_id, count) == (1, 2)
+    assert spans == [(text.index('whale'), text.index('swam')), (text.index('whale'), text.index('past'))]
+
+
+def test_top_k_ranks_like_the_full_ranking(index):
+    ranking = index.search('whale OR ship OR python', limit=len(BOOKS))
+    for limit in range(1, len(BOOKS) + 1):
+        assert index.search('whale OR ship OR python', limit=limit) == ranking[:limit]
+
+
+def test_exclusion_groups_exclude_each_word(index):
+    assert matching(index, 'whale (-python -r)') == [1]
+    assert matching(index, 'whale -(-python -r)') == [2, 3]
+
+
+def test_and_without_included_words_is_a_query_error(index):
+    with pytest.raises(QueryError):
+        index.search(And([], [Term('python')]))
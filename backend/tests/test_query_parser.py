@@ -0,0 +1,63 @@
+import pytest
+
+from app.utils.query_parser import QueryError, canonical_query, parse_query, to_fts5
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('whale (-python -r)', "And([Term('whale')], excluded=[Term('python'), Term('r')])"),
+    ('whale (NOT python)', "And([Term('whale')], excluded=[Term('python')])"),
+    ('whale AND (-python -r) -ruby', "And([Term('whale')], excluded=[Term('python'), Term('r'), Term('ruby')])"),
+    ('whale -(-python -r)', "And([Term('whale'), Or([Term('python'), Term('r')])], excluded=[])"),
+])
+def test_exclusion_groups_join_the_enclosing_and(query, expected):
+    assert repr(parse_query(query)) == expected
+
+
+def test_exclusion_groups_translate_to_fts5():
+    assert to_fts5(parse_query('whale (-python -r)')) == '((("whale") NOT "python") NOT "r")'
+
+
+@pytest.mark.parametrize('query', ['(-python -r)', '-python', '(-python -r) OR whale'])
+def test_queries_without_included_words_are_rejected(query):
+    with pytest.raises(QueryError):
+        parse_query(query)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('a b OR c', "Or([And([Term('a'), Term('b')], excluded=[]), Term('c')])"),
+    ('a OR b c', "Or([Term('a'), And([Term('b'), Term('c')], excluded=[])])"),
+    ('a AND (b OR c)', "And([Term('a'), Or([Term('b'), Term('c')])], excluded=[])"),
+    ('a OR b OR c', "Or([Term('a'), Term('b'), Term('c')])"),
+    ('"a b" NEAR/3 c', "Near(Phrase(['a', 'b']), Term('c'), 3)"),
+    ('a NEAR b', "Near(Term('a'), Term('b'), 10)"),
+    ('e-mail', "Phrase(['e', 'mail'])"),
+    ('Whale*', "Prefix('whale')"),
+    ('(a)', "Term('a')"),
+])
+def test_operators_bind_from_or_to_near(query, expected):
+    assert repr(parse_query(query)) == expected
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('NOT a b', "And([Term('b')], excluded=[Term('a')])"),
+    ('-a b -"c d"', "And([Term('b')], excluded=[Term('a'), Phrase(['c', 'd'])])"),
+    ('NOT NOT a', "Term('a')"),
+    ('-(-a -b)', "Or([Term('a'), Term('b')])"),
+])
+def test_negation(query, expected):
+    assert repr(parse_query(query)) == expected
+
+
+@pytest.mark.parametrize('query', [
+    '(a', 'a)', '""', 'NOT', 'a NEAR (b OR c)', 'a NEAR b NEAR c', '-a OR b', 'x* y*z*'
+])
+def test_invalid_queries_are_rejected(query):
+    with pytest.raises(QueryError):
+        parse_query(query)
+
+
+def test_canonical_query_ignores_spelling_and_operand_order():
+    assert canonical_query(parse_query('b a')) == canonical_query(parse_query('A AND b'))
+    assert canonical_query(parse_query('b OR a')) == canonical_query(parse_query('a OR b'))
+    # Matches of a NEAR are counted for its left operand
+    assert canonical_query(parse_query('a NEAR b')) != canonical_query(parse_query('b NEAR a'))
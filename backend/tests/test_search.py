@@ -0,0 +1,8 @@
+def test_exclusion_groups_are_searched(client, auth_headers):
+    response = client.post('/api/search/', json={'query': 'whale (-python -r)'}, headers=auth_headers)
+    assert response.status_code == 200
+
+
+def test_queries_without_included_words_are_bad_requests(client, auth_headers):
+    response = client.post('/api/search/', json={'query': '(-python -r)'}, headers=auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from app import db, ranked_results
+from app.models.book import Book
+from app.models.search import Search, SearchResult
+
+RESULTS_PER_SEARCH = 3
+# Results of the largest search, each from a different book
+MAX_RESULTS = 50
+
+
+@pytest.fixture
+def books(app):
+    with app.app_context():
+        books = [
+            Book(title=f'Book {number}', file_path=f'/library/book{number}.pdf', file_format='pdf')
+            for number in range(MAX_RESULTS)
+        ]
+        db.session.add_all(books)
+        db.session.commit()
+        return [book.id for book in books]
+
+
+def save_searches(app, user_id, book_ids, count):
+    """Save searches with their results, and snippets, to the history of a user; returns their ids."""
+    search_ids = []
+    with app.app_context():
+        for _ in range(count):
+            search = Search(query='whale', user_id=user_id, result_count=len(book_ids))
+            db.session.add(search)
+            db.session.flush()
+            search_ids.append(search.id)
+            for rank, book_id in enumerate(book_ids):
+                snippets = [{'text': '**whale**', 'page': 1, 'label': None}]
+                db.session.add(SearchResult(
+                    search_id=search.id,
+                    book_id=book_id,
+                    relevance_score=1.0 / (rank + 1),
+                    match_context=snippets[0]['text'],
+                    page=1,
+                    snippets=json.dumps(snippets)
+                ))
+        db.session.commit()
+    return search_ids
+
+
+def test_history_listing_runs_constant_number_of_statements(app, client, auth_headers, user_id, books,
+                                                            count_statements):
+    statement_counts = []
+    for count in (1, 49):
+        save_searches(app, user_id, books[:RESULTS_PER_SEARCH], count)
+        with count_statements() as statements:
+            response = client.get('/api/search/history?limit=100', headers=auth_headers)
+        assert response.status_code == 200
+        statement_counts.append(len(statements))
+
+    assert response.get_json()['count'] == 50
+    assert all(search['result_count'] == RESULTS_PER_SEARCH for search in response.get_json()['searches'])
+    assert statement_counts[0] == statement_counts[1]
+
+
+def test_search_results_run_constant_number_of_statements(app, client, auth_headers, user_id, books,
+                                                          count_statements):
+    statement_counts = []
+    for result_count in (1, MAX_RESULTS):
+        book_ids = books[:result_count]
+        search_id, = save_searches(app, user_id, book_ids, 1)
+        # Load the results from the history rather than from the ranking of a recent search
+        ranked_results.clear()
+        with count_statements() as statements:
+            response = client.get(f'/api/search/history/{search_id}?limit={MAX_RESULTS}', headers=auth_headers)
+        assert response.status_code == 200
+        statement_counts.append(len(statements))
+
+        body = response.get_json()
+        assert body['total'] == result_count
+        assert [result['book']['id'] for result in body['results']] == book_ids
+
+    assert statement_counts[0] == statement_counts[1]
@@ -0,0 +1,18 @@
+from app.utils.text_index import InvertedIndex
+from app.utils.tokenizer import tokenize_sections
+
+SECTIONS = ['Call me Ishmael.', 'Some years ago, never mind how long', 'precisely, having little money']
+
+
+def test_matches_have_the_offsets_of_the_tokenizer(tmp_path):
+    index = InvertedIndex(str(tmp_path / 'search_index.db'))
+    # Small segments, so a phrase runs across the postings of two of them
+    index.SEGMENT_TOKENS = 4
+    index.add_document(1, SECTIONS)
+
+    offsets = {term: offset for _, offset, term in tokenize_sections(SECTIONS)}
+    (book_id, _, matches), = index.search('"mind how long precisely"')
+    assert book_id == 1
+    assert matches == [(offsets['mind'], offsets['precisely'])]
+    assert index.search('ishmael OR money')[0][2] == [(offsets['ishmael'], offsets['ishmael']),
+                                                     (offsets['money'], offsets['money'])]
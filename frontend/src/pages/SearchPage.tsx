@@ -19,6 +19,25 @@ interface LocationState {
   query?: string;
 }
 
+// Results fetched per request; more are loaded on demand
+const PAGE_SIZE = 20;
+
+// Transform an API search result to match our expected format
+const transformResult = (result: any): Book => ({
+  id: result.book.id,
+  title: result.book.title || 'Untitled',
+  author: result.book.author || 'Unknown Author',
+  description: result.snippets && result.snippets.length > 0
+    ? result.snippets
+        .map((snippet: any) => snippet.page
+          ? `${result.book.file_format === 'pdf' ? 'Page' : 'Chapter'} ${snippet.page}: ${snippet.text}`
+          : snippet.text)
+        .join(' … ')
+    : 'No description available',
+  fileType: result.book.file_format,
+  relevance: result.relevance,
+});
+
 const SearchPage: React.FC = () => {
   const location = useLocation();
   const navigate = useNavigate();
@@ -32,6 +51,11 @@ const SearchPage: React.FC = () => {
   const [scanningLibrary, setScanningLibrary] = useState(false);
   const [scanMessage, setScanMessage] = useState<string | null>(null);
   const [currentQuery, setCurrentQuery] = useState<string>('');
+  const [searchId, setSearchId] = useState<number | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [totalResults, setTotalResults] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [searchProgress, setSearchProgress] = useState<{ searched: number; total: number } | null>(null);
 
   // If there's an initial query from location state, perform search automatically
   useEffect(() => {
@@ -84,14 +108,35 @@ const SearchPage: React.FC = () => {
 
       console.log('Scanning library...');
       const response = await axios.post('/api/books/scan', {}, {
-        headers: { 
+        headers: {
           'Authorization': `Bearer ${token}`,
           'Content-Type': 'application/json'
         }
       });
-      
+
       console.log('Library scan response:', response.data);
-      setScanMessage(`Successfully indexed ${response.data.count} books.`);
+
+      // The scan runs in the background, so poll the job until it finishes
+      const jobId = response.data.job_id;
+      let job = response.data.job;
+      while (job.status === 'queued' || job.status === 'running') {
+        const processed = job.phase === 'indexing'
+          ? `indexed ${job.books_indexed} of ${job.books_to_index} books`
+          : `processed ${job.files_processed} of ${job.files_discovered} files`;
+        const eta = job.eta_seconds != null ? `, about ${Math.ceil(job.eta_seconds)}s left` : '';
+        setScanMessage(`Scanning library: ${processed}${eta}...`);
+
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const statusResponse = await axios.get(`/api/books/scan/${jobId}`, {
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        job = statusResponse.data.job;
+      }
+
+      if (job.status !== 'completed') {
+        throw new Error(job.error || `Scan ${job.status}`);
+      }
+      setScanMessage(`Successfully indexed ${job.summary.total} books.`);
     } catch (err: any) {
       console.error('Error scanning library:', err);
       
@@ -118,6 +163,11 @@ const SearchPage: React.FC = () => {
     setError(null);
     setHasSearched(true);
     setCurrentQuery(query);
+    setSearchResults([]);
+    setSearchId(null);
+    setNextCursor(null);
+    setTotalResults(0);
+    setSearchProgress(null);
 
     try {
       const token = localStorage.getItem('token');
@@ -126,29 +176,60 @@ const SearchPage: React.FC = () => {
       }
 
       console.log('Searching for:', query);
-      const response = await axios.post('/api/search/', 
-        { query: query.trim() },
-        {
-          headers: {
-            'Authorization': `Bearer ${token}`,
-            'Content-Type': 'application/json'
-          }
+      // Stream the search so books are shown as soon as they match
+      const response = await fetch('/api/search/stream', {
+        method: 'POST',
+        headers: {
+          'Authorization': `Bearer ${token}`,
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ query: query.trim(), limit: PAGE_SIZE })
+      });
+
+      if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        // Same shape as axios errors, for the error handling below
+        throw { response: { status: response.status, data }, message: `Request failed with status ${response.status}` };
+      }
+
+      // The response is newline-delimited JSON events
+      const handleEvent = (event: any) => {
+        switch (event.type) {
+          case 'progress':
+            setSearchProgress({ searched: event.searched, total: event.total });
+            break;
+          case 'hit':
+            setSearchResults(previous => [...previous, transformResult(event)]);
+            break;
+          case 'results':
+            console.log('Search response:', event);
+            // Replace the hits found so far with the first page of the final ranking
+            setSearchResults(event.results.map(transformResult));
+            setSearchId(event.search_id);
+            setNextCursor(event.next_cursor);
+            setTotalResults(event.total);
+            break;
+          case 'error':
+            throw new Error(event.error);
         }
-      );
+      };
 
-      console.log('Search response:', response.data);
-      
-      // Transform API response to match our expected format
-      const transformedResults = response.data.results.map((result: any) => ({
-        id: result.book.id,
-        title: result.book.title || 'Untitled',
-        author: result.book.author || 'Unknown Author',
-        description: result.context || 'No description available',
-        fileType: result.book.file_format,
-        relevance: result.relevance,
-      }));
-      
-      setSearchResults(transformedResults);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+          break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() || '';
+        lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+      }
+      if (buffer.trim()) {
+        handleEvent(JSON.parse(buffer));
+      }
     } catch (err: any) {
       console.error('Error during search:', err);
       
@@ -167,8 +248,37 @@ const SearchPage: React.FC = () => {
         setError(`Search failed: ${errorMessage}`);
         setSearchResults([]);
       }
+      setNextCursor(null);
     } finally {
       setLoading(false);
+      setSearchProgress(null);
+    }
+  };
+
+  // Fetch the next page of the current search without running it again
+  const handleLoadMore = async () => {
+    if (!searchId || !nextCursor) {
+      return;
+    }
+
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`/api/search/history/${searchId}`, {
+        params: { cursor: nextCursor, limit: PAGE_SIZE },
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      });
+
+      setSearchResults(previous => [...previous, ...response.data.results.map(transformResult)]);
+      setNextCursor(response.data.next_cursor);
+    } catch (err: any) {
+      console.error('Error loading more results:', err);
+      const errorMessage = err.response?.data?.error || err.message;
+      setError(`Loading more results failed: ${errorMessage}`);
+    } finally {
+      setLoadingMore(false);
     }
   };
 
@@ -232,6 +342,7 @@ const SearchPage: React.FC = () => {
           {hasSearched && currentQuery && (
             <Alert severity="info" sx={{ mt: 2 }}>
               Search results for: "{currentQuery}"
+              {searchProgress && ` (searched ${searchProgress.searched} of ${searchProgress.total} books...)`}
             </Alert>
           )}
         </Paper>
@@ -239,10 +350,18 @@ const SearchPage: React.FC = () => {
         {hasSearched && (
           <SearchResults 
             results={searchResults} 
-            loading={loading} 
+            loading={loading && searchResults.length === 0} 
             error={error} 
           />
         )}
+
+        {hasSearched && !loading && nextCursor && (
+          <Box sx={{ mt: 3, display: 'flex', justifyContent: 'center' }}>
+            <Button variant="outlined" onClick={handleLoadMore} disabled={loadingMore}>
+              {loadingMore ? 'Loading...' : `Load more (${searchResults.length} of ${totalResults})`}
+            </Button>
+          </Box>
+        )}
       </Box>
     </Container>
   );